@@ -0,0 +1,95 @@
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+STORAGE = "storage"
+FIRESTORE = "firestore"
+
+
+def _create_storage_client(project: str = None):
+    from google.cloud import storage
+
+    return storage.Client(project=project)
+
+
+def _create_firestore_client(project: str = None):
+    from google.cloud import firestore
+
+    return firestore.Client(project=project)
+
+
+class ClientRegistry:
+    """Creates Google Cloud clients once, and shares them across callers.
+
+    Constructing a client resolves credentials and opens a new HTTP session,
+    so clients are cached per (kind, project) and reused. Lookups are
+    thread-safe. Tests can `register()` fakes or `set_factory()` to replace
+    how clients are made.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str], Any] = {}
+        self._factories: Dict[str, Callable[[str], Any]] = {
+            STORAGE: _create_storage_client,
+            FIRESTORE: _create_firestore_client,
+        }
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, project: str = None):
+        """Gets the client of this kind for a project, creating it if needed.
+
+        Arguments:
+            kind (str): the kind of client, such as "storage" or "firestore"
+            project (str): Optional. The Google Cloud project. None uses the
+                project of the environment's default credentials.
+
+        Returns:
+            The shared client
+        """
+        key = (kind, project)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self._factories[kind](project)
+
+            return self._clients[key]
+
+    def storage(self, project: str = None):
+        """Gets the shared Cloud Storage client for a project."""
+        return self.get(STORAGE, project)
+
+    def firestore(self, project: str = None):
+        """Gets the shared Firestore client for a project."""
+        return self.get(FIRESTORE, project)
+
+    def register(self, kind: str, client, project: str = None):
+        """Uses an existing client, such as a fake, for a kind and project."""
+        with self._lock:
+            self._clients[(kind, project)] = client
+
+    def set_factory(self, kind: str, factory: Callable[[str], Any]):
+        """Replaces how clients of a kind are created.
+
+        Arguments:
+            kind (str): the kind of client
+            factory (Callable): takes a project (str or None) and returns a
+                new client
+        """
+        with self._lock:
+            self._factories[kind] = factory
+
+    def clear(self):
+        """Forgets every cached client."""
+        with self._lock:
+            self._clients.clear()
+
+
+registry = ClientRegistry()
+
+
+def get_storage_client(project: str = None):
+    """Gets the shared Cloud Storage client for a project."""
+    return registry.storage(project)
+
+
+def get_firestore_client(project: str = None):
+    """Gets the shared Firestore client for a project."""
+    return registry.firestore(project)
@@ -1,31 +1,133 @@
-from google.cloud import firestore
-
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List
 
+from fantasy_maps.gcp.clients import get_firestore_client
 from fantasy_maps.image.image_metadata import ImageMetadata
 
+# Firestore allows at most 500 writes in one batch
+MAX_BATCH_SIZE = 500
+
 def store_metadata_fs(*,
                       project_id: str,
                       img_metadata: ImageMetadata,
-                      collection_name: str):
+                      collection_name: str,
+                      client=None):
     """Upserts image metadata into a Firestore collection.
 
     Arguments:
         project_id (str): the Google Cloud project to store these in
         img_metadata (ImageMetadata): the image's metadata
         collection_name (str): the Firestore collection to store the data in
+        client (firestore.Client): Optional. The client to use. Defaults to
+            the shared client for project_id.
+    """
+
+    client = client or get_firestore_client(project_id)
+
+    img_dict = _to_firestore_dict(img_metadata)
+    uid = img_metadata.uid
+
+    # upsert the dict directly into Firestore!
+    client.collection(collection_name).document(uid).set(img_dict)
+
+
+def store_metadata_fs_bulk(*,
+                           project_id: str,
+                           images: Iterable[ImageMetadata],
+                           collection_name: str,
+                           client=None,
+                           batch_size: int = MAX_BATCH_SIZE,
+                           max_workers: int = 4,
+                           retries: int = 3,
+                           backoff: float = 0.5) -> Dict[str, Exception]:
+    """Upserts metadata for many images into a Firestore collection.
+
+    Records are written in batches of up to 500, with several batches
+    committed concurrently. A batch that fails with a transient error, such
+    as contention, is retried with exponential backoff. If a batch still
+    fails, its records are written one at a time so that only the records
+    that actually fail are reported.
+
+    Arguments:
+        project_id (str): the Google Cloud project to store these in
+        images (Iterable[ImageMetadata]): the images' metadata
+        collection_name (str): the Firestore collection to store the data in
+        client (firestore.Client): Optional. The client to use. Defaults to
+            the shared client for project_id.
+        batch_size (int): Optional. The number of records per batch
+        max_workers (int): Optional. The number of concurrent batches
+        retries (int): Optional. The number of times to retry a batch
+        backoff (float): Optional. The seconds to wait before the first
+            retry. The wait doubles with each retry.
+
+    Returns:
+        Dict of image uid to the error raised while writing it, for every
+        record that couldn't be written. Empty if every record was written.
     """
+    from google.api_core import exceptions
+
+    retryable_errors = (
+        exceptions.Aborted,
+        exceptions.DeadlineExceeded,
+        exceptions.InternalServerError,
+        exceptions.ResourceExhausted,
+        exceptions.ServiceUnavailable,
+    )
+
+    client = client or get_firestore_client(project_id)
+    collection = client.collection(collection_name)
+    batch_size = min(batch_size, MAX_BATCH_SIZE)
+
+    def commit(records: List[ImageMetadata]) -> Dict[str, Exception]:
+        docs = [(r.uid, _to_firestore_dict(r)) for r in records]
+
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                time.sleep(backoff * 2 ** (attempt - 1))
+
+            batch = client.batch()
+            for uid, doc in docs:
+                batch.set(collection.document(uid), doc)
+
+            try:
+                batch.commit()
+                return {}
+            except retryable_errors:
+                continue
+            except Exception:
+                break
+
+        # Find out which records caused the batch to fail
+        errors = {}
+        for uid, doc in docs:
+            try:
+                collection.document(uid).set(doc)
+            except Exception as e:
+                errors[uid] = e
 
-    client = firestore.Client(project=project_id)
+        return errors
 
+    images = list(images)
+    batches = [images[i:i + batch_size]
+               for i in range(0, len(images), batch_size)]
+
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch_errors in executor.map(commit, batches):
+            errors.update(batch_errors)
+
+    return errors
+
+
+def _to_firestore_dict(img_metadata: ImageMetadata) -> dict:
+    """PRIVATE. Converts image metadata into a Firestore document."""
     img_dict = img_metadata.to_dict()
 
     # clean up the data a little bit before upserting
     file_name = img_metadata.path.split("/")[-1]
     img_dict.pop("path", None)
     img_dict["filename"] = file_name
-    uid = img_metadata.uid
-
-    # upsert the dict directly into Firestore!
-    client.collection(collection_name).document(uid).set(img_dict)
 
+    return img_dict
@@ -0,0 +1,198 @@
+import json
+import re
+import threading
+from typing import List, Mapping, Union
+
+# Cloud Storage can compose at most 32 source objects in one request
+MAX_COMPOSE_SOURCES = 32
+
+
+class TrainingManifestWriter:
+    """Writes Vertex AI training data rows to Cloud Storage, append-only.
+
+    Rows are buffered locally and flushed as numbered shard files, such as
+    `<prefix>/index-00042.jsonl`, so existing data is never downloaded or
+    rewritten. `compose()` merges every shard into a single manifest.
+
+    The merged manifest has the same name as the file that
+    `ProcessedGridImage.store_image_as_dataset_row` rewrites. If that file
+    exists before any shard does, the first flush copies it into the first
+    shard, so its rows are kept when the shards are merged.
+
+    Use it as a context manager to flush any remaining rows at the end of a
+    batch session. If the block raises, the remaining rows aren't flushed:
+
+        with TrainingManifestWriter(bucket, "maps") as writer:
+            for row in rows:
+                writer.write(row)
+        writer.compose()
+
+    Any object with the `blob()` and `list_blobs()` methods of
+    `google.cloud.storage.Bucket` can be used as the bucket.
+    """
+
+    def __init__(self, bucket, prefix: str, *, basename: str = "index",
+                 rows_per_shard: int = 1000, compose_every: int = 0):
+        """Instantiates the TrainingManifestWriter class
+
+        Arguments:
+            bucket (google.cloud.storage.Bucket): the bucket to write to
+            prefix (str): the prefix or "folder" in the bucket to write to
+            basename (str): Optional. The name of the merged manifest file,
+                without the extension. Shard files add a number to it.
+            rows_per_shard (int): Optional. The number of rows to buffer
+                before flushing them as a new shard
+            compose_every (int): Optional. If set, merge all the shards into
+                the manifest after every `compose_every` flushed shards
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.basename = basename
+        self.rows_per_shard = rows_per_shard
+        self.compose_every = compose_every
+
+        self._rows = []
+        self._next_shard = None
+        self._flushed_shards = 0
+        self._lock = threading.Lock()
+        self._shard_pattern = re.compile(
+            rf"^{re.escape(prefix)}/{re.escape(basename)}-(\d+)\.jsonl$"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    @property
+    def manifest_name(self) -> str:
+        """The name of the merged manifest blob."""
+        return f"{self.prefix}/{self.basename}.jsonl"
+
+    def write(self, row: Mapping):
+        """Adds a training data row, flushing a new shard if needed.
+
+        Arguments:
+            row (dict): the training data row
+        """
+        with self._lock:
+            self._rows.append(json.dumps(row))
+            is_full = len(self._rows) >= self.rows_per_shard
+
+        if is_full:
+            self.flush()
+
+    def flush(self) -> Union[str, None]:
+        """Uploads all buffered rows as a new shard.
+
+        If the upload fails, the rows stay buffered for the next flush.
+
+        Returns:
+            The name (str) of the new shard blob, or None if there were no
+            buffered rows
+        """
+        from google.api_core.exceptions import PreconditionFailed
+
+        with self._lock:
+            if not self._rows:
+                return None
+
+            data = "\n".join(self._rows) + "\n"
+
+            if self._next_shard is None:
+                numbers = [self._shard_number(n) for n in self.shard_names()]
+                if not numbers and self._adopt_manifest():
+                    numbers = [0]
+                self._next_shard = max(numbers, default=-1) + 1
+
+            # Don't overwrite a shard that another writer created first
+            while True:
+                name = self._shard_name(self._next_shard)
+                self._next_shard += 1
+                try:
+                    self.bucket.blob(name).upload_from_string(
+                        data,
+                        content_type="application/jsonl",
+                        if_generation_match=0,
+                    )
+                    break
+                except PreconditionFailed:
+                    continue
+
+            self._rows = []
+            self._flushed_shards += 1
+            should_compose = (self.compose_every and
+                              self._flushed_shards % self.compose_every == 0)
+
+        if should_compose:
+            self.compose()
+
+        return name
+
+    def shard_names(self) -> List[str]:
+        """Lists the names of the shard blobs in the bucket, in order."""
+        names = [b.name for b in self.bucket.list_blobs(
+            prefix=f"{self.prefix}/{self.basename}-")]
+        names = [n for n in names if self._shard_pattern.match(n)]
+        return sorted(names, key=self._shard_number)
+
+    def compose(self) -> Union[str, None]:
+        """Merges every shard, in order, into the manifest blob.
+
+        Returns:
+            The name (str) of the manifest blob, or None if there were no
+            shards to merge
+        """
+        shards = [self.bucket.blob(n) for n in self.shard_names()]
+        if not shards:
+            return None
+
+        manifest = self.bucket.blob(self.manifest_name)
+        manifest.compose(shards[:MAX_COMPOSE_SOURCES])
+
+        rest = shards[MAX_COMPOSE_SOURCES:]
+        step = MAX_COMPOSE_SOURCES - 1
+        for i in range(0, len(rest), step):
+            manifest.compose([manifest] + rest[i:i + step])
+
+        return self.manifest_name
+
+    def _adopt_manifest(self) -> bool:
+        """PRIVATE. Copies an existing manifest into the first shard.
+
+        Returns:
+            True if the first shard now exists
+        """
+        from google.api_core.exceptions import NotFound, PreconditionFailed
+
+        try:
+            data = self.bucket.blob(self.manifest_name).download_as_bytes()
+        except NotFound:
+            return False
+
+        if not data.strip():
+            return False
+        if not data.endswith(b"\n"):
+            data += b"\n"
+
+        try:
+            self.bucket.blob(self._shard_name(0)).upload_from_string(
+                data,
+                content_type="application/jsonl",
+                if_generation_match=0,
+            )
+        except PreconditionFailed:
+            # Another writer copied it first
+            pass
+
+        return True
+
+    def _shard_name(self, number: int) -> str:
+        """PRIVATE. Gets the blob name of a numbered shard."""
+        return f"{self.prefix}/{self.basename}-{number:05d}.jsonl"
+
+    def _shard_number(self, name: str) -> int:
+        """PRIVATE. Gets the number of a shard from its blob name."""
+        return int(self._shard_pattern.match(name).group(1))
@@ -1,11 +1,33 @@
-from google.cloud import storage
+import base64
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Tuple
 
+from fantasy_maps.gcp.clients import get_storage_client
 from fantasy_maps.image import ImageMetadata
 
+HASH_CHUNK_SIZE = 1024 * 1024
+GCS_SCHEME = "gs://"
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024
+DEFAULT_CACHE_DIRECTORY = os.path.join("tmp", "gcs-cache")
+
+# GcsImageCache only reads and deletes files inside these subdirectories of
+# its directory, so it never touches files that it didn't write.
+CACHE_OBJECTS_DIR = "objects"
+CACHE_INCOMING_DIR = "incoming"
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
 def store_image_gcs(*, project_id: str, 
                     img_metadata: ImageMetadata,
                     bucket_name: str,
-                    prefix: str):
+                    prefix: str,
+                    client=None):
     """Copies a local image to Google Cloud Storage.
 
     Arguments:
@@ -13,12 +35,14 @@ def store_image_gcs(*, project_id: str,
         img_metadata (ImageMetadata): Metadata of the file to save
         bucket_name (str): the Cloud Storage bucket to use
         prefix (str): the prefix or "folder" to use in the bucket
+        client (storage.Client): Optional. The client to use. Defaults to the
+            shared client for project_id.
 
     Returns:
         String. The Cloud Storage URI of the image.
     """
 
-    storage_client = storage.Client(project=project_id)
+    storage_client = client or get_storage_client(project_id)
     bucket = storage_client.bucket(bucket_name)
 
     local_path = img_metadata.path
@@ -30,3 +54,281 @@ def store_image_gcs(*, project_id: str,
     file_blob.upload_from_filename(local_path)
 
     return img_gcs_uri
+
+
+def store_images_gcs(images: Iterable[ImageMetadata],
+                     bucket_name: str,
+                     prefix: str,
+                     *,
+                     project_id: str = None,
+                     client=None,
+                     max_workers: int = 16) -> Dict[str, str]:
+    """Copies many local images to Google Cloud Storage concurrently.
+
+    The prefix is listed once up front. Images whose blob already exists
+    with the same MD5 hash (or CRC32C, for blobs without an MD5 hash) are
+    skipped rather than uploaded again.
+
+    Arguments:
+        images (Iterable[ImageMetadata]): Metadata of the files to save
+        bucket_name (str): the Cloud Storage bucket to use
+        prefix (str): the prefix or "folder" to use in the bucket
+        project_id (str): Optional. The Google Cloud Project ID to use
+        client (storage.Client): Optional. The client to use. Defaults to the
+            shared client for project_id.
+        max_workers (int): Optional. The number of concurrent uploads.
+
+    Returns:
+        Dict of image uid to the Cloud Storage URI of the image, for every
+        image that was uploaded or already present.
+    """
+    storage_client = client or get_storage_client(project_id)
+    bucket = storage_client.bucket(bucket_name)
+
+    existing = {
+        b.name: (b.md5_hash, getattr(b, "crc32c", None))
+        for b in storage_client.list_blobs(bucket_name, prefix=f"{prefix}/")
+    }
+
+    def upload(img_metadata: ImageMetadata):
+        local_path = img_metadata.path
+        file_name = local_path.split("/")[-1]
+        blob_name = f"{prefix}/{file_name}"
+        img_gcs_uri = f"gs://{bucket_name}/{blob_name}"
+
+        md5_hash, crc32c = existing.get(blob_name, (None, None))
+        try:
+            if not _matches_blob(local_path, md5_hash=md5_hash,
+                                 crc32c=crc32c):
+                bucket.blob(blob_name).upload_from_filename(local_path)
+        except Exception as e:
+            print(f"Error: {e}\n{local_path}")
+            return None
+
+        return (img_metadata.uid, img_gcs_uri)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(upload, images)
+        return dict(r for r in results if r is not None)
+
+
+def _matches_blob(local_path: str, *, md5_hash: str, crc32c: str) -> bool:
+    """PRIVATE. Checks a local file against a blob's base64-encoded hash."""
+    if md5_hash:
+        local_hash = hashlib.md5()
+        expected_hash = md5_hash
+    elif crc32c:
+        import google_crc32c
+
+        local_hash = google_crc32c.Checksum()
+        expected_hash = crc32c
+    else:
+        return False
+
+    with open(local_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            local_hash.update(chunk)
+
+    local_hash = base64.b64encode(local_hash.digest()).decode("utf-8")
+    return local_hash == expected_hash
+
+
+def parse_gcs_uri(uri: str) -> Tuple[str, str]:
+    """Splits a Cloud Storage URI into its bucket and blob names.
+
+    Arguments:
+        uri (str): a URI like "gs://bucket/prefix/file.jpg"
+
+    Returns:
+        Tuple of the bucket name and the blob name, such as
+        ("bucket", "prefix/file.jpg")
+
+    Raises:
+        ValueError: if the URI isn't a gs:// URI of an object
+    """
+    if not uri.startswith(GCS_SCHEME):
+        raise ValueError(f"Not a Cloud Storage URI: {uri}")
+
+    bucket_name, _, blob_name = uri[len(GCS_SCHEME):].partition("/")
+    if not bucket_name or not blob_name or blob_name.endswith("/"):
+        raise ValueError(f"Not a Cloud Storage object URI: {uri}")
+
+    return (bucket_name, blob_name)
+
+
+class GcsImageCache:
+    """A local disk cache of images downloaded from Cloud Storage.
+
+    Each object is fetched directly by name and stored at
+    `<directory>/objects/<bucket>/<blob name>`, after downloading to a
+    temporary file in `<directory>/incoming`. When the cache grows past
+    `max_bytes`, the least recently used objects are deleted. Objects already
+    in the directory are picked up on start, oldest first by modification
+    time, and a cache hit updates the file's modification time, so the order
+    carries over between processes. Only files under `objects` are ever
+    deleted.
+
+        cache = GcsImageCache("tmp/gcs-cache")
+        local_path = cache.fetch("gs://bucket/prefix/file.jpg")
+    """
+
+    def __init__(self, directory: str, *,
+                 max_bytes: int = DEFAULT_CACHE_BYTES,
+                 project_id: str = None,
+                 client=None):
+        """Instantiates the GcsImageCache class
+
+        Arguments:
+            directory (str): the local directory to store images in
+            max_bytes (int): Optional. The largest total size of the cached
+                files, in bytes
+            project_id (str): Optional. The Google Cloud Project ID to use
+            client (storage.Client): Optional. The client to use. Defaults to
+                the shared client for project_id.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.project_id = project_id
+        self._client = client
+        self._lock = threading.Lock()
+
+        # Maps local path to file size, least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._total_bytes = 0
+        self._load()
+
+    def __contains__(self, uri: str) -> bool:
+        try:
+            return self.local_path(uri) in self._entries
+        except ValueError:
+            return False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        """The total size of the cached files, in bytes."""
+        return self._total_bytes
+
+    def local_path(self, uri: str) -> str:
+        """Gets the path that an object is cached at.
+
+        Raises:
+            ValueError: if the URI isn't a gs:// URI of an object, or the
+                object's name has an empty, "." or ".." part, which would
+                put it outside of its bucket's directory or on top of
+                another object
+        """
+        bucket_name, blob_name = parse_gcs_uri(uri)
+        parts = [bucket_name] + blob_name.split("/")
+        if any(p in ("", ".", "..") or os.sep in p for p in parts):
+            raise ValueError(f"Object can't be cached: {uri}")
+
+        return os.path.join(self.directory, CACHE_OBJECTS_DIR, *parts)
+
+    def fetch(self, uri: str, *, client=None) -> str:
+        """Gets a local copy of an object, downloading it if needed.
+
+        Arguments:
+            uri (str): the Cloud Storage URI of the object
+            client (storage.Client): Optional. The client to download with,
+                instead of the cache's client.
+
+        Returns:
+            String. The path of the local copy.
+
+        Raises:
+            google.api_core.exceptions.NotFound: if the object doesn't exist
+            ValueError: if the object can't be cached, see `local_path()`
+        """
+        path = self.local_path(uri)
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+                os.utime(path)
+                return path
+
+        bucket_name, blob_name = parse_gcs_uri(uri)
+        client = (client or self._client or
+                  get_storage_client(self.project_id))
+        blob = client.bucket(bucket_name).blob(blob_name)
+
+        incoming_dir = os.path.join(self.directory, CACHE_INCOMING_DIR)
+        os.makedirs(incoming_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(incoming_dir, uuid.uuid4().hex)
+        try:
+            blob.download_to_filename(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        with self._lock:
+            self._total_bytes -= self._entries.pop(path, 0)
+            self._entries[path] = os.path.getsize(path)
+            self._total_bytes += self._entries[path]
+            self._evict(keep=path)
+
+        return path
+
+    def clear(self):
+        """Deletes every cached file."""
+        with self._lock:
+            for path in self._entries:
+                _remove_file(path)
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def _load(self):
+        """PRIVATE. Indexes the objects already in the cache directory."""
+        found = []
+        objects_dir = os.path.join(self.directory, CACHE_OBJECTS_DIR)
+        for dirpath, _, filenames in os.walk(objects_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                found.append((stat.st_mtime, path, stat.st_size))
+
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._total_bytes += size
+
+        self._evict()
+
+    def _evict(self, keep: str = None):
+        """PRIVATE. Deletes least recently used files until under budget."""
+        while self._total_bytes > self.max_bytes and self._entries:
+            path = next(iter(self._entries))
+            if path == keep:
+                # Never delete the file that was just fetched
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(path)
+                continue
+
+            self._total_bytes -= self._entries.pop(path)
+            _remove_file(path)
+
+
+def get_image_cache() -> GcsImageCache:
+    """Gets the shared image cache in DEFAULT_CACHE_DIRECTORY.
+
+    The cache is created, and its directory indexed, on the first call only.
+    """
+    global _default_cache
+
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = GcsImageCache(DEFAULT_CACHE_DIRECTORY)
+
+        return _default_cache
+
+
+def _remove_file(path: str):
+    """PRIVATE. Deletes a file, if it still exists."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -8,9 +8,42 @@ __version__ = "0.1.0"
 __author__ = "Eric Schmidt"
 __credits__ = "Google, LLC"
 
-from .image_metadata import ImageMetadata, BBox
+import importlib
+
+from .image_metadata import ImageMetadata, BBox, BBoxCollection
+from .catalog import ImageCatalog
 
 __all__ = (
   'ImageMetadata',
   'BBox',
+  'BBoxCollection',
+  'ImageCatalog',
 )
+
+# Submodules are only imported when first accessed, since some of them pull in
+# slow-to-import dependencies (PIL, imgaug, google-cloud-storage).
+_SUBMODULES = frozenset((
+  'catalog',
+  'converter',
+  'download_cache',
+  'extract',
+  'grid',
+  'image_metadata',
+  'large_image',
+  'parquet_io',
+  'probe',
+  'process_predictions',
+  'processed_grid_image',
+  'shards',
+))
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
@@ -0,0 +1,131 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from typing import Iterable, Iterator, List, Mapping, Union
+
+import numpy as np
+
+from .image_metadata import ImageMetadata
+
+STRING_FIELDS = ('url', 'rid', 'title', 'uid', 'path', 'gcs_uri',
+                 'parent_uid')
+# Cell dimensions come after width, height, columns and rows so that they
+# aren't recalculated when converting back to ImageMetadata.
+INT_FIELDS = ('width', 'height', 'columns', 'rows', 'cell_width',
+              'cell_height', 'cell_offset_x', 'cell_offset_y')
+FLOAT_FIELDS = ('shard_scale', 'grid_confidence')
+BOOL_FIELDS = ('is_shard', 'is_usable')
+FIELDS = STRING_FIELDS + INT_FIELDS + FLOAT_FIELDS + BOOL_FIELDS
+
+
+class ImageCatalog:
+    """A compact, columnar store of metadata for many images.
+
+    Each field of `ImageMetadata` (except bounding boxes) is stored as one
+    NumPy array, so filters run as array operations:
+
+        big_maps = catalog[catalog.is_usable & (catalog.cells >= 500)]
+
+    Indexing with an int returns an `ImageMetadata`; indexing with a slice,
+    boolean mask or index array returns a new `ImageCatalog`.
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, columns: Mapping[str, np.ndarray]):
+        """Instantiates the ImageCatalog class
+
+        Arguments:
+            columns (dict): an array for every field in FIELDS, all of the
+                same length
+        """
+        data = {}
+        for name in FIELDS:
+            if name in STRING_FIELDS:
+                dtype = object
+            elif name in INT_FIELDS:
+                dtype = np.int64
+            elif name in FLOAT_FIELDS:
+                dtype = np.float64
+            else:
+                dtype = bool
+            data[name] = np.asarray(columns[name], dtype=dtype)
+
+        lengths = {len(c) for c in data.values()}
+        if len(lengths) > 1:
+            raise ValueError("Every column must have the same length")
+
+        self._data = data
+
+    @classmethod
+    def from_metadata(cls, images: Iterable[ImageMetadata]) -> 'ImageCatalog':
+        """Builds a catalog from ImageMetadata objects."""
+        images = list(images)
+        return cls({name: [getattr(img, name) for img in images]
+                    for name in FIELDS})
+
+    def __len__(self) -> int:
+        return len(self._data['url'])
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        # _data isn't set yet while unpickling or copying, so looking it up
+        # here would recurse
+        if name == '_data' or name.startswith('__'):
+            raise AttributeError(name)
+
+        try:
+            return self._data[name]
+        except KeyError:
+            raise AttributeError(
+                f"'ImageCatalog' object has no attribute {name!r}"
+            ) from None
+
+    def __getitem__(self, index) -> Union[ImageMetadata, 'ImageCatalog']:
+        if isinstance(index, (int, np.integer)):
+            return self._to_metadata(index)
+
+        return ImageCatalog({name: column[index]
+                             for name, column in self._data.items()})
+
+    def __iter__(self) -> Iterator[ImageMetadata]:
+        for i in range(len(self)):
+            yield self._to_metadata(i)
+
+    def __repr__(self):
+        return f"ImageCatalog(len={len(self)})"
+
+    @property
+    def cells(self) -> np.ndarray:
+        """The number of grid cells (columns * rows) in each image."""
+        return self._data['columns'] * self._data['rows']
+
+    def filter(self, mask: np.ndarray) -> 'ImageCatalog':
+        """Returns the images where `mask` is True."""
+        return self[np.asarray(mask, dtype=bool)]
+
+    def to_metadata(self) -> List[ImageMetadata]:
+        """Converts every image in the catalog back into ImageMetadata."""
+        return list(self)
+
+    def _to_metadata(self, index: int) -> ImageMetadata:
+        """PRIVATE. Converts one image in the catalog into ImageMetadata."""
+        values = {name: column[index].item() if name not in STRING_FIELDS
+                  else column[index]
+                  for name, column in self._data.items()}
+
+        return ImageMetadata(
+            url=values.pop('url'),
+            rid=values.pop('rid'),
+            title=values.pop('title'),
+            **values,
+        )
@@ -1,8 +1,47 @@
+import argparse
+import glob
+import gzip
+import json
 import math
-from typing import Tuple, Union
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields
+from typing import IO, Iterable, Iterator, List, Sequence, Tuple, Union
 
+import numpy as np
 
-def convert_fantasy_map_to_bounding_boxes(map_dict: dict) -> Tuple:
+# Gzip files always start with these two bytes
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Uncompressed prediction files are split into chunks of about this many
+# bytes, so that one large file can be converted by several processes.
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+# The types of bounding boxes convert_fantasy_map_to_bounding_boxes returns
+BBOX_OUTPUTS = ("dict", "array", "float32")
+
+
+@dataclass
+class ConversionStats:
+    """Counts of what a batch prediction conversion kept and dropped."""
+    rows_read: int = 0
+    rows_written: int = 0
+    rows_skipped: int = 0
+    kept_boxes: int = 0
+    dropped_boxes: int = 0
+
+    def __add__(self, other: "ConversionStats") -> "ConversionStats":
+        return ConversionStats(**{
+            f.name: getattr(self, f.name) + getattr(other, f.name)
+            for f in fields(self)
+        })
+
+
+def convert_fantasy_map_to_bounding_boxes(
+    map_dict: dict, *, output: str = "dict"
+) -> Tuple[Union[List[dict], np.ndarray], str, int, int]:
     """Translates fantasy map values from dictionary into bounding boxes.
 
     After conversion, the bounding boxes can then be used as input for VertexAI
@@ -19,10 +58,18 @@ def convert_fantasy_map_to_bounding_boxes(map_dict: dict) -> Tuple:
 
     Args:
         map_dict: the dictionary with the fantasy map values
+        output: Optional. The type of bboxes to return. "dict" (the default)
+            returns a list of dicts with xMin, yMin, yMax and xMax keys.
+            "array" returns an (N, 4) float64 array with x_min, x_max, y_min,
+            y_max columns, and "float32" returns the same as float32.
 
     Returns:
         Tuple of bboxes, file_name, width, and height
     """
+    if output not in BBOX_OUTPUTS:
+        raise ValueError(f"output must be one of {BBOX_OUTPUTS}, "
+                         f"not {output!r}")
+
     height = map_dict["imageHeight"]
     width = map_dict["imageWidth"]
     cell_width = map_dict["cellWidth"]
@@ -31,28 +78,30 @@ def convert_fantasy_map_to_bounding_boxes(map_dict: dict) -> Tuple:
     num_columns = math.floor(width / cell_width) - 1
     num_rows = math.floor(height / cell_height) - 1
 
-    bboxes = []
-
-    for x in range(1, num_columns):
-        for y in range(1, num_rows):
-            x_min_tmp = map_dict["cellOffsetX"] + (cell_width * x) - 2
-            x_max_tmp = x_min_tmp + cell_width + 4
-            y_min_tmp = map_dict["cellOffsetY"] + (cell_height * y) - 2
-            y_max_tmp = y_min_tmp + cell_height + 4
-
-            x_min_train = x_min_tmp / width
-            x_max_train = x_max_tmp / width
-            y_min_train = y_min_tmp / height
-            y_max_train = y_max_tmp / height
-
-            bboxes.append(
-                {
-                    "xMin": x_min_train,
-                    "yMin": y_min_train,
-                    "yMax": y_max_train,
-                    "xMax": x_max_train,
-                }
-            )
+    # Cells are ordered by column, then by row within each column
+    x_min, y_min = np.meshgrid(
+        map_dict["cellOffsetX"] + cell_width * np.arange(1, num_columns) - 2,
+        map_dict["cellOffsetY"] + cell_height * np.arange(1, num_rows) - 2,
+        indexing="ij",
+    )
+    x_min = x_min.ravel()
+    y_min = y_min.ravel()
+
+    boxes = np.empty((x_min.size, 4), dtype=np.float64)
+    boxes[:, 0] = x_min / width
+    boxes[:, 1] = (x_min + cell_width + 4) / width
+    boxes[:, 2] = y_min / height
+    boxes[:, 3] = (y_min + cell_height + 4) / height
+
+    if output == "dict":
+        bboxes = [
+            {"xMin": x0, "yMin": y0, "yMax": y1, "xMax": x1}
+            for x0, x1, y0, y1 in boxes.tolist()
+        ]
+    elif output == "float32":
+        bboxes = boxes.astype(np.float32)
+    else:
+        bboxes = boxes
 
     file_name = map_dict["path"].split("/")[-1]
 
@@ -115,23 +164,9 @@ def convert_batch_predictions_to_training_data(
         None if all predictions are below the minimum confidence value
     """
     try:
-        print(json_data)
         image_gcs_uri = json_data["instance"]["content"]
-        prediction = json_data["prediction"]
-        bboxes = []
-
-        for num, value in enumerate(prediction["confidences"]):
-            if value > minimum_confidence_value:
-                bbox = prediction["bboxes"][num]
-                bboxes.append(
-                    {
-                        "displayName": "cell",  # "cell" is a constant
-                        "xMin": bbox[0],
-                        "yMin": bbox[2],
-                        "xMax": bbox[1],
-                        "yMax": bbox[3],
-                    }
-                )
+        bboxes, _ = _filter_prediction(json_data["prediction"],
+                                       minimum_confidence_value)
 
         if len(bboxes) == 0:
             return None
@@ -140,3 +175,336 @@ def convert_batch_predictions_to_training_data(
 
     except KeyError as key_error:
         print(f"Input has incorrect or missing key.\nFull error:\n{key_error}")
+
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    """Reads a JSONL file one row at a time.
+
+    Gzip-compressed files are detected and decompressed as they're read, so
+    memory use doesn't depend on the size of the file.
+
+    Args:
+        path: the local path of the .jsonl or .jsonl.gz file
+
+    Returns:
+        Iterator of dict, one for each non-empty line. Lines that aren't
+        valid JSON are reported and skipped.
+    """
+    for line in _read_lines(path):
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            print(f"Error: {e}\n{path}")
+
+
+def iter_training_data(
+    rows: Iterable[dict],
+    *,
+    minimum_confidence_value: float = 0.5,
+    stats: ConversionStats = None,
+) -> Iterator[dict]:
+    """Transforms IOD batch prediction rows into training data, lazily.
+
+    See `convert_batch_predictions_to_training_data` for the input and
+    output formats.
+
+    Args:
+        rows: the (batch) prediction rows to transform, as dicts or as lines
+            of JSON
+        minimum_confidence_value: the lowest allowable confidence value to
+            allow in the resulting output. Default value is 0.5.
+        stats: Optional. Updated with counts of rows and bounding boxes as
+            they are processed.
+
+    Returns:
+        Iterator of Vertex AI image object detection training data rows.
+        Rows that aren't valid JSON, with missing keys, or with every
+        prediction below the minimum confidence value, are skipped.
+    """
+    stats = stats if stats is not None else ConversionStats()
+
+    for row in rows:
+        stats.rows_read += 1
+        if isinstance(row, (str, bytes)):
+            try:
+                row = json.loads(row)
+            except ValueError as e:
+                print(f"Error: {e}\nSkipping malformed row")
+                stats.rows_skipped += 1
+                continue
+
+        try:
+            image_gcs_uri = row["instance"]["content"]
+            bboxes, num_dropped = _filter_prediction(row["prediction"],
+                                                     minimum_confidence_value)
+        except (IndexError, KeyError, TypeError, ValueError):
+            stats.rows_skipped += 1
+            continue
+
+        stats.kept_boxes += len(bboxes)
+        stats.dropped_boxes += num_dropped
+
+        if len(bboxes) == 0:
+            stats.rows_skipped += 1
+            continue
+
+        stats.rows_written += 1
+        yield {"imageGcsUri": image_gcs_uri, "boundingBoxAnnotations": bboxes}
+
+
+def convert_batch_prediction_file(
+    input_path: str,
+    output_path: str,
+    *,
+    minimum_confidence_value: float = 0.5,
+) -> ConversionStats:
+    """Converts a Vertex batch prediction file into a training data file.
+
+    Rows are read, filtered and written one at a time, so memory use stays
+    constant however large the files are. Files ending in `.gz` are written
+    gzip-compressed; compressed input is detected automatically.
+
+    Args:
+        input_path: the local path of the batch prediction .jsonl file
+        output_path: the local path of the training data .jsonl file to write
+        minimum_confidence_value: the lowest allowable confidence value to
+            allow in the resulting output. Default value is 0.5.
+
+    Returns:
+        ConversionStats with the counts of rows and bounding boxes kept and
+        dropped
+    """
+    stats = ConversionStats()
+    rows = iter_training_data(
+        _read_lines(input_path),
+        minimum_confidence_value=minimum_confidence_value,
+        stats=stats,
+    )
+
+    with _open_text(output_path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row))
+            f.write("\n")
+
+    return stats
+
+
+def convert_batch_prediction_files(
+    inputs: Union[str, Sequence[str]],
+    output_path: str,
+    *,
+    minimum_confidence_value: float = 0.5,
+    max_workers: int = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> ConversionStats:
+    """Converts many Vertex batch prediction files in parallel.
+
+    Uncompressed files are split into chunks of lines, and every chunk is
+    converted in a pool of worker processes. Gzip-compressed files can't be
+    split, so each is a single chunk. The converted chunks are merged into
+    one training data file in order of file name and position within the
+    file, so the output is the same however many workers are used.
+
+    Args:
+        inputs: a directory of `.jsonl`/`.jsonl.gz` files, a glob pattern,
+            or a list of file paths
+        output_path: the local path of the training data .jsonl file to write
+        minimum_confidence_value: the lowest allowable confidence value to
+            allow in the resulting output. Default value is 0.5.
+        max_workers: Optional. The number of worker processes. Defaults to
+            the number of CPUs.
+        chunk_size: Optional. The approximate number of bytes in each chunk
+            of an uncompressed file
+
+    Returns:
+        ConversionStats for all of the files combined
+
+    Raises:
+        FileNotFoundError: if `inputs` doesn't match any files
+    """
+    paths = _resolve_prediction_files(inputs)
+    if not paths:
+        raise FileNotFoundError(f"No prediction files found: {inputs}")
+
+    chunks = [c for p in paths for c in _chunk_file(p, chunk_size)]
+
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+        part_paths = [os.path.join(tmp_dir, f"part-{n:05d}.jsonl")
+                      for n in range(len(chunks))]
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            all_stats = list(executor.map(
+                _convert_chunk,
+                chunks,
+                part_paths,
+                [minimum_confidence_value] * len(chunks),
+            ))
+
+        with _open_text(output_path, "w") as out:
+            for part_path in part_paths:
+                with open(part_path, "r", encoding="utf-8") as part:
+                    shutil.copyfileobj(part, out)
+
+    return sum(all_stats, ConversionStats())
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """Command-line entry point for converting batch prediction files."""
+    parser = argparse.ArgumentParser(
+        description="Convert Vertex AI batch prediction files into image "
+                    "object detection training data.")
+    parser.add_argument("inputs", nargs="+",
+                        help="prediction files, a directory or a glob")
+    parser.add_argument("-o", "--output", required=True,
+                        help="the training data .jsonl(.gz) file to write")
+    parser.add_argument("--min-confidence", type=float, default=0.5,
+                        help="the lowest confidence value to keep")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="the number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="the bytes per chunk of uncompressed files")
+    args = parser.parse_args(argv)
+
+    inputs = args.inputs[0] if len(args.inputs) == 1 else args.inputs
+    try:
+        stats = convert_batch_prediction_files(
+            inputs,
+            args.output,
+            minimum_confidence_value=args.min_confidence,
+            max_workers=args.workers,
+            chunk_size=args.chunk_size,
+        )
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        return 1
+
+    print(f"Rows: {stats.rows_read} read, {stats.rows_written} written, "
+          f"{stats.rows_skipped} skipped")
+    print(f"Bounding boxes: {stats.kept_boxes} kept, "
+          f"{stats.dropped_boxes} dropped")
+    return 0
+
+
+def _resolve_prediction_files(inputs: Union[str, Sequence[str]]) -> List[str]:
+    """PRIVATE. Expands a directory or glob into sorted file paths."""
+    if not isinstance(inputs, str):
+        return sorted(inputs)
+
+    if os.path.isdir(inputs):
+        return sorted(glob.glob(os.path.join(inputs, "*.jsonl")) +
+                      glob.glob(os.path.join(inputs, "*.jsonl.gz")))
+
+    return sorted(glob.glob(inputs))
+
+
+def _chunk_file(path: str,
+                chunk_size: int) -> List[Tuple[str, int, Union[int, None]]]:
+    """PRIVATE. Splits a file into (path, start, end) byte ranges."""
+    with open(path, "rb") as f:
+        is_gzip = f.read(2) == GZIP_MAGIC
+
+    size = os.path.getsize(path)
+    if is_gzip or size <= chunk_size:
+        return [(path, 0, None)]
+
+    return [(path, start, min(start + chunk_size, size))
+            for start in range(0, size, chunk_size)]
+
+
+def _read_lines(path: str) -> Iterator[str]:
+    """PRIVATE. Reads the non-empty lines of a text or gzip file."""
+    with _open_text(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def _read_chunk(path: str, start: int,
+                end: Union[int, None]) -> Iterator[Union[str, bytes]]:
+    """PRIVATE. Reads the lines that begin within a byte range of a file.
+
+    Lines are left unparsed, so that `iter_training_data` can skip the
+    malformed ones.
+    """
+    if end is None:
+        yield from _read_lines(path)
+        return
+
+    with open(path, "rb") as f:
+        if start > 0:
+            # Skip the rest of a line that began in the previous chunk
+            f.seek(start - 1)
+            f.readline()
+
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield line
+
+
+def _convert_chunk(chunk: Tuple[str, int, Union[int, None]], part_path: str,
+                   minimum_confidence_value: float) -> ConversionStats:
+    """PRIVATE. Converts one chunk of a prediction file, in a worker."""
+    stats = ConversionStats()
+    rows = iter_training_data(
+        _read_chunk(*chunk),
+        minimum_confidence_value=minimum_confidence_value,
+        stats=stats,
+    )
+
+    with open(part_path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row))
+            f.write("\n")
+
+    return stats
+
+
+def _filter_prediction(
+    prediction: dict, minimum_confidence_value: float
+) -> Tuple[List[dict], int]:
+    """PRIVATE. Keeps the bounding boxes above the minimum confidence.
+
+    Returns:
+        Tuple of the kept bounding boxes in training data format, and the
+        number of bounding boxes dropped
+    """
+    confidences = np.asarray(prediction["confidences"], dtype=np.float64)
+    is_kept = confidences > minimum_confidence_value
+
+    bboxes = np.asarray(prediction["bboxes"], dtype=np.float64)
+    bboxes = bboxes.reshape(-1, 4)[:len(confidences)][is_kept]
+
+    annotations = [
+        {
+            "displayName": "cell",  # "cell" is a constant
+            "xMin": x_min,
+            "yMin": y_min,
+            "xMax": x_max,
+            "yMax": y_max,
+        }
+        for x_min, x_max, y_min, y_max in bboxes.tolist()
+    ]
+
+    return (annotations, len(confidences) - len(annotations))
+
+
+def _open_text(path: str, mode: str) -> IO[str]:
+    """PRIVATE. Opens a text file, compressed with gzip or not."""
+    if mode == "r":
+        with open(path, "rb") as f:
+            is_gzip = f.read(2) == GZIP_MAGIC
+    else:
+        is_gzip = path.endswith(".gz")
+
+    if is_gzip:
+        return gzip.open(path, mode + "t", encoding="utf-8")
+
+    return open(path, mode, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
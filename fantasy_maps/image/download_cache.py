@@ -0,0 +1,135 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from typing import Union
+
+
+class DownloadCache:
+    """A content-addressed, on-disk store of downloaded images.
+
+    Images are stored once per uid (the SHA-1 of the file) at
+    `<directory>/objects/<uid[:2]>/<uid>`. A SQLite index maps each
+    downloaded URL to its uid, so a repeated URL can be served without a
+    network request. Files are shared with hard links wherever possible.
+    """
+
+    def __init__(self, directory: str):
+        """Instantiates the DownloadCache class
+
+        Arguments:
+            directory (str): the local directory to keep the cache in. It is
+                created if it doesn't exist.
+        """
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"),
+                                   check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS urls "
+                "(url TEXT PRIMARY KEY, uid TEXT NOT NULL)"
+            )
+
+    def __contains__(self, uid: str) -> bool:
+        return os.path.exists(self.object_path(uid))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes the URL index."""
+        with self._lock:
+            self._db.close()
+
+    def object_path(self, uid: str) -> str:
+        """Gets the path that the image with this uid is stored at."""
+        return os.path.join(self.directory, "objects", uid[:2], uid)
+
+    def lookup(self, url: str) -> Union[str, None]:
+        """Gets the uid of a previously downloaded URL.
+
+        Arguments:
+            url (str): the URL of the image
+
+        Returns:
+            The uid (str) of the image, or None if the URL isn't cached
+        """
+        with self._lock:
+            row = self._db.execute("SELECT uid FROM urls WHERE url = ?",
+                                   (url,)).fetchone()
+
+        if row is None or row[0] not in self:
+            return None
+
+        return row[0]
+
+    def add(self, *, url: str, uid: str, path: str):
+        """Records a downloaded image in the cache.
+
+        If an image with the same uid is already stored, the file at `path`
+        is replaced with a hard link to the stored copy. Otherwise, the file
+        at `path` becomes the stored copy.
+
+        Arguments:
+            url (str): the URL the image was downloaded from
+            uid (str): the hash value of the image
+            path (str): the local path that the image was downloaded to
+        """
+        obj_path = self.object_path(uid)
+        os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+
+        if uid in self:
+            self.link(uid=uid, path=path)
+        else:
+            _link_or_copy(path, obj_path)
+
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO urls (url, uid) VALUES (?, ?)",
+                (url, uid)
+            )
+
+    def link(self, *, uid: str, path: str):
+        """Places a stored image at `path`, replacing any file there.
+
+        Arguments:
+            uid (str): the hash value of the image
+            path (str): the local path to place the image at
+        """
+        obj_path = self.object_path(uid)
+        if os.path.exists(path) and os.path.samefile(obj_path, path):
+            return
+
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        _link_or_copy(obj_path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def _link_or_copy(src: str, dst: str):
+    """PRIVATE. Hard links a file, or copies it across file systems."""
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(src, dst)
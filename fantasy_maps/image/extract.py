@@ -11,14 +11,33 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from PIL import Image
-from PIL.Image import DecompressionBombError, DecompressionBombWarning
-
+# PIL and requests are imported where they're used, so that importing this
+# module stays cheap for callers that only need the bounding box helpers.
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterable, List, Tuple
 import hashlib
 import math
-import requests
+import numpy as np
+import os
+import threading
+import time
+import urllib.parse
+import uuid
+
+from .download_cache import DownloadCache
+from .image_metadata import ImageMetadata, BBoxCollection
+from .probe import probe_image_size
+from .large_image import open_large_image
+
+if TYPE_CHECKING:
+    import requests
 
-from .image_metadata import ImageMetadata, BBox
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Seconds to wait to connect to a server, and then between bytes of a
+# response, before giving up on a download
+DOWNLOAD_TIMEOUT = (10.0, 60.0)
 
 
 def convert_image_to_hash(content: str) -> str:
@@ -38,109 +57,305 @@ def convert_image_to_hash(content: str) -> str:
     return jpg_hash
 
 
-def download_image_local(*, url: str, path: str) -> str:
+def download_image_local(*, url: str, path: str,
+                         chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                         session: 'requests.Session' = None,
+                         cache: DownloadCache = None,
+                         timeout: Tuple[float, float] = DOWNLOAD_TIMEOUT
+                         ) -> str:
     """Download an image from the internet to local file system.
 
+    The image is streamed to a temporary file next to `path` in fixed-size
+    chunks, hashing each chunk as it arrives, and then renamed to `path`.
+    Memory use doesn't grow with the size of the image, and `path` never
+    holds a partial download.
+
     Arguments:
         url (str): the image to download
         path (str): the local path to save the image.
+        chunk_size (int): Optional. The number of bytes to read at a time.
+        session (requests.Session): Optional. A session to reuse pooled
+            connections from.
+        cache (DownloadCache): Optional. A cache of previous downloads. A
+            cached URL is linked to `path` without a network request.
+        timeout (tuple): Optional. The (connect, read) timeouts, in seconds.
 
     Returns:
         Hash value (str) of image file
+
+    Raises:
+        requests.Timeout: if the server doesn't respond within `timeout`
+    """
+    _, uid = _download(url=url, path=path, chunk_size=chunk_size,
+                       session=session, cache=cache, timeout=timeout)
+    return uid
+
+
+def download_images_local(
+    images: Iterable[ImageMetadata],
+    *,
+    directory: str,
+    make_filename: Callable[[ImageMetadata], str] = None,
+    max_workers: int = 16,
+    per_host_limit: int = 4,
+    retries: int = 3,
+    backoff: float = 0.5,
+    session: 'requests.Session' = None,
+    cache: DownloadCache = None,
+    timeout: Tuple[float, float] = DOWNLOAD_TIMEOUT,
+) -> List[ImageMetadata]:
+    """Downloads many images concurrently, reusing pooled connections.
+
+    Downloads run in a thread pool that shares one `requests.Session`, so
+    connections to the same host are reused. Failed downloads are retried
+    with exponential backoff on connection errors, timeouts and retryable
+    HTTP status codes.
+
+    Arguments:
+        images (Iterable[ImageMetadata]): the images to download, by `url`
+        directory (str): the local directory to save the images to
+        make_filename (Callable): Optional. Returns the file name for an
+            image, or "" to skip it. Defaults to the last part of the URL.
+        max_workers (int): Optional. The number of concurrent downloads.
+        per_host_limit (int): Optional. The number of concurrent downloads
+            from any one host.
+        retries (int): Optional. The number of times to retry a download.
+        backoff (float): Optional. The seconds to wait before the first
+            retry. The wait doubles with each retry.
+        session (requests.Session): Optional. The session to download with.
+        cache (DownloadCache): Optional. A cache of previous downloads.
+        timeout (tuple): Optional. The (connect, read) timeouts, in seconds,
+            for each attempt.
+
+    Returns:
+        List of the ImageMetadata that were downloaded, in input order, with
+        `uid` and `path` filled in. Images that couldn't be downloaded or
+        saved are left out.
+    """
+    import requests
+
+    make_filename = make_filename or _url_filename
+
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers,
+                                                pool_maxsize=max_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+    host_limits = {}
+    host_limits_lock = threading.Lock()
+
+    def download(img_metadata: ImageMetadata) -> bool:
+        filename = make_filename(img_metadata)
+        if filename == "":
+            return False
+
+        host = urllib.parse.urlparse(img_metadata.url).netloc
+        with host_limits_lock:
+            limit = host_limits.setdefault(
+                host, threading.BoundedSemaphore(per_host_limit))
+
+        path = os.path.join(directory, filename)
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                time.sleep(backoff * 2 ** (attempt - 1))
+
+            try:
+                with limit:
+                    status, uid = _download(url=img_metadata.url, path=path,
+                                            session=session, cache=cache,
+                                            timeout=timeout)
+            except requests.RequestException as e:
+                print(f"Error: {e}\n{img_metadata.url}")
+                continue
+            except OSError as e:
+                # Local errors, such as a full disk, won't go away on retry
+                print(f"Error: {e}\n{path}")
+                return False
+
+            if uid:
+                img_metadata.uid = uid
+                img_metadata.path = path
+                return True
+
+            if status not in RETRY_STATUS_CODES:
+                break
+
+        return False
+
+    images = list(images)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        downloaded = list(executor.map(download, images))
+
+    return [img for img, ok in zip(images, downloaded) if ok]
+
+
+def _download(*, url: str, path: str,
+              chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+              session: 'requests.Session' = None,
+              cache: DownloadCache = None,
+              timeout: Tuple[float, float] = DOWNLOAD_TIMEOUT
+              ) -> Tuple[int, str]:
+    """PRIVATE. Streams a URL to a file, or links it from the cache.
+
+    Returns:
+        Tuple of the HTTP status code and the hash value (str) of the file,
+        which is "" if the download failed
     """
+    if cache is not None:
+        uid = cache.lookup(url)
+        if uid:
+            cache.link(uid=uid, path=path)
+            return (200, uid)
+
+    if session is None:
+        import requests
+        session = requests
+
+    with session.get(url, stream=True, timeout=timeout) as r:
+        if r.status_code != 200:
+            return (r.status_code, "")
 
-    r = requests.get(url, stream=True)
-    if r.status_code == 200:
-        r.raw.decode_content = True
-        uid = convert_image_to_hash(r.content)
+        sha1 = hashlib.sha1()
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
 
-        with open(path, "wb") as f:
-            f.write(r.content)
+        try:
+            with open(tmp_path, "xb") as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    sha1.update(chunk)
+                    f.write(chunk)
 
-        return uid
+            os.replace(tmp_path, path)
 
-    return ""
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    uid = sha1.hexdigest()
+    if cache is not None:
+        cache.add(url=url, uid=uid, path=path)
+
+    return (r.status_code, uid)
+
+
+def _url_filename(img_metadata: ImageMetadata) -> str:
+    """PRIVATE. Gets the file name from the last part of an image's URL."""
+    return urllib.parse.urlparse(img_metadata.url).path.split("/")[-1]
 
 
 def get_image_width_and_height(path):
-    """Open the image and get the image's height and width in pixels.
+    """Get the image's height and width in pixels.
+
+    The dimensions are read from the image file's header where possible,
+    falling back to opening the image with PIL. The image is never decoded,
+    so images of any size can be measured.
 
     Arguments:
-        path (str):
+        path (str): the path to the image
 
     Returns:
         Tuple of width, height
     """
-    try:
-        img = Image.open(path)
-        w, h = img.size
+    size = probe_image_size(path)
+    if size is not None:
+        return size
 
-    except DecompressionBombError:
-        print(f"Image too large: {path}")
-        return (0, 0)
+    with open_large_image(path) as img:
+        w, h = img.size
 
     return (math.floor(w), math.floor(h))
 
 
+def get_images_width_and_height(
+    paths: Iterable[str], *, max_workers: int = 16
+) -> List[Tuple[int, int]]:
+    """Gets the height and width in pixels of many images concurrently.
+
+    Arguments:
+        paths (Iterable[str]): the paths to the images
+        max_workers (int): Optional. The number of images to probe at once.
+
+    Returns:
+        List of tuples of width, height, in the same order as `paths`
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(get_image_width_and_height, paths))
+
+
+def compute_bbox_array(
+    *,
+    img_metadata: ImageMetadata,
+) -> np.ndarray:
+    """Determines bounding boxes for every inner cell of an image's grid.
+
+    The whole grid is built with NumPy broadcasting rather than per-cell
+    Python loops, so the cost stays linear in the number of cells.
+
+    Arguments:
+        img_metadata (ImageMetadata): the width, height, columns, rows and
+            cell dimensions of an image
+
+    Returns:
+        An (N, 4) float array with columns `x_min, x_max, y_min, y_max`,
+        normalized as a percentage of total width or height. Rows are ordered
+        row by row, left to right.
+    """
+    width = img_metadata.width
+    height = img_metadata.height
+    cell_width = img_metadata.cell_width
+    cell_height = img_metadata.cell_height
+
+    if not (width and height):
+        raise ValueError("Image width and height must be non-zero")
+
+    BORDER = 1  # 1px border around the outside of the cell
+
+    x_steps = np.arange(max(img_metadata.columns - 2, 0)) * cell_width
+    y_steps = np.arange(max(img_metadata.rows - 2, 0)) * cell_height
+
+    x_mins = (x_steps + (cell_width - BORDER)) / width
+    x_maxs = (x_steps + (2 * cell_width + BORDER)) / width
+    y_mins = (y_steps + (cell_height - BORDER)) / height
+    y_maxs = (y_steps + (2 * cell_height + BORDER)) / height
+
+    num_x = x_mins.shape[0]
+    num_y = y_mins.shape[0]
+
+    coords = np.empty((num_y, num_x, 4), dtype=np.float64)
+    coords[:, :, 0] = x_mins[np.newaxis, :]
+    coords[:, :, 1] = x_maxs[np.newaxis, :]
+    coords[:, :, 2] = y_mins[:, np.newaxis]
+    coords[:, :, 3] = y_maxs[:, np.newaxis]
+
+    return coords.reshape(-1, 4)
+
+
 def compute_bboxes(
     *,
     img_metadata: ImageMetadata,
-):
+) -> BBoxCollection:
     """Determines bounding boxes for image object detection.
 
     Arguments:
-        img_data_dict: a dict containing width, height, columns, rows of an img
-        cell_width (int): the width of cells in the image
-        cell_height (int): the height of cells in the image
+        img_metadata (ImageMetadata): the width, height, columns, rows and
+            cell dimensions of an image
 
     Returns:
-        List of dict with dimensions of each cell "normalized" in COCO format:
-        represented as a percentage of total width or height.
+        BBoxCollection with dimensions of each cell "normalized" in COCO
+        format: represented as a percentage of total width or height. The
+        collection is empty if the bounding boxes can't be computed.
     """
-    bboxes = []
+    LABEL = "cell"
+
+    bboxes = BBoxCollection(np.empty((0, 4)), label=LABEL)
     try:
-        if img_metadata:
-            width = img_metadata.width
-            height = img_metadata.height
-            columns = img_metadata.columns
-            rows = img_metadata.rows
-            cell_width = img_metadata.cell_width
-            cell_height = img_metadata.cell_height
-        else:
+        if not img_metadata:
             return bboxes
 
-        BORDER = 1  # 1px border around the outside of the cell
-        LABEL = "cell"
-
-        x_coords = []
-        curr_x_min = cell_width - BORDER
-        curr_x_max = (2 * cell_width) + BORDER
-        for _ in range(0, columns - 2):
-            x_coords.append(
-                {
-                    "xMin": curr_x_min / width,
-                    "xMax": curr_x_max / width,
-                }
-            )
-            curr_x_min += cell_width
-            curr_x_max += cell_width
-
-        curr_y_min = cell_height - BORDER
-        curr_y_max = (2 * cell_height) + BORDER
-        for _ in range(0, rows - 2):
-            tmp_bboxes = [
-                BBox(
-                    x_max=x["xMax"],
-                    x_min=x["xMin"],
-                    y_max=curr_y_max / height,
-                    y_min=curr_y_min / height,
-                    label=LABEL,
-                )
-                for x in x_coords
-            ]
-            bboxes = bboxes + tmp_bboxes
-            curr_y_min += cell_height
-            curr_y_max += cell_height
+        coords = compute_bbox_array(img_metadata=img_metadata)
+        bboxes = BBoxCollection(coords, label=LABEL)
 
     except Exception as e:
         print(f"Error: {e}\n{img_metadata}:")
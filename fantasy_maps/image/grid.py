@@ -0,0 +1,395 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from dataclasses import dataclass
+from typing import Union
+
+import numpy as np
+
+from .image_metadata import ImageMetadata
+from .large_image import DEFAULT_MAX_BYTES, load_bounded, open_large_image
+
+# Box centers closer than this fraction of the pitch are jitter within the
+# same column or row, not a step to the next one.
+MIN_STEP_FRACTION = 0.5
+
+# Boxes further than this fraction of the pitch from the nearest cell center
+# are outliers when fitting the grid.
+INLIER_FRACTION = 0.25
+REFIT_ITERATIONS = 2
+
+# Images are downscaled so their longest side is at most this many pixels
+# before looking for grid lines.
+DETECT_MAX_SIZE = 1024
+
+# The smallest grid cell to look for, in downscaled pixels
+MIN_PERIOD = 4
+
+# Fewer cells than this along an axis isn't a grid
+MIN_CELLS = 3
+
+# Profiles are high-pass filtered with a moving average of this many
+# pixels, which keeps thin grid lines and removes broad shading, then
+# blurred a little with this kernel.
+SMOOTHING_WINDOW = 7
+LINE_BLUR = np.array([1, 4, 6, 4, 1]) / 16
+
+# How far from an expected grid line, in downscaled pixels, the profile is
+# used to refit the period and phase
+LINE_HALF_WIDTH = 3
+
+# Detections at or above this confidence don't need a Vertex prediction
+DEFAULT_MIN_CONFIDENCE = 0.5
+
+
+@dataclass
+class GridEstimate:
+    """The size and position of a square-ish grid on an image, in pixels.
+
+    The offsets are where the first grid line falls, from 0 up to (but not
+    including) the cell size.
+    """
+    cell_width: float
+    cell_height: float
+    offset_x: float
+    offset_y: float
+
+
+@dataclass
+class GridDetection(GridEstimate):
+    """A grid found in an image's pixels.
+
+    The confidence is from 0 (no repeating lines) to 1 (evenly spaced lines
+    across the whole image), the weaker of the two axes.
+    """
+    columns: int
+    rows: int
+    confidence: float
+
+
+def estimate_grid(boxes: np.ndarray, *, confidences=None,
+                  min_confidence: float = 0.0) -> GridEstimate:
+    """Estimates the grid pitch and offset from detected grid cells.
+
+    Every box with a confidence of at least `min_confidence` is used. Each
+    axis is estimated on its own:
+
+    1. The initial pitch is the median box size, which ignores outliers.
+    2. Box centers less than half a cell apart are grouped into the same
+       column (or row). The median difference between the mean centers of
+       neighboring groups, divided by the number of cells between them,
+       refines the pitch.
+    3. The circular mean of the groups, corrected by the median distance of
+       every box from its nearest cell center, places the grid.
+    4. Each box is assigned to its nearest cell, and the pitch and position
+       are refitted with least squares to the boxes near a cell center.
+
+    The offset is found from box centers, so boxes that are drawn a little
+    too large or small don't move the grid.
+
+    Arguments:
+        boxes (np.ndarray): (N, 4) array of x_min, x_max, y_min, y_max pixel
+            values of the detected cells
+        confidences (Sequence[float]): Optional. The confidence score of each
+            box.
+        min_confidence (float): Optional. The lowest confidence score of a
+            box to use. If no box is confident enough, all boxes are used.
+
+    Returns:
+        GridEstimate
+
+    Raises:
+        ValueError: if there are no boxes
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        raise ValueError("Can't estimate a grid without any boxes")
+
+    if confidences is not None:
+        is_confident = np.asarray(confidences) >= min_confidence
+        if is_confident.any():
+            boxes = boxes[is_confident]
+
+    cell_width, offset_x = _estimate_axis(boxes[:, 0], boxes[:, 1])
+    cell_height, offset_y = _estimate_axis(boxes[:, 2], boxes[:, 3])
+
+    return GridEstimate(cell_width=cell_width, cell_height=cell_height,
+                        offset_x=offset_x, offset_y=offset_y)
+
+
+def detect_grid(path: str, *,
+                max_size: int = DETECT_MAX_SIZE,
+                max_bytes: int = DEFAULT_MAX_BYTES) -> GridDetection:
+    """Finds the grid lines of a map image from its pixels, without Vertex.
+
+    The image is decoded at a reduced size with `load_bounded()`, converted
+    to grayscale and downscaled so its longest side is at most `max_size`.
+    For each axis:
+
+    1. The absolute brightness differences between neighboring pixels are
+       averaged along every column (or row), so lines that cross the whole
+       image stand out, and broad shading is filtered out.
+    2. The period of that profile is the highest peak of its
+       autocorrelation, computed with an FFT, refined to a fraction of a
+       pixel with its multiples.
+    3. The phase is the circular mean of the profile, folded at the period.
+       The period and phase are then refitted with least squares to the
+       parts of the profile near each expected line.
+
+    Arguments:
+        path (str): the local path of the image
+        max_size (int): Optional. The longest side of the downscaled image
+        max_bytes (int): Optional. The most memory decoding the image may use
+
+    Returns:
+        GridDetection, in pixels of the full size image
+
+    Raises:
+        ValueError: if the image can't be decoded within `max_bytes`
+    """
+    with open_large_image(path) as img:
+        width, height = img.size
+        img, _ = load_bounded(img, max_bytes=max_bytes,
+                              reduce_factor=max(width, height) // max_size)
+        img = img.convert("L")
+        img.thumbnail((max_size, max_size))
+        pixels = np.asarray(img, dtype=np.float32)
+
+    scale_x = width / pixels.shape[1]
+    scale_y = height / pixels.shape[0]
+
+    # Vertical lines change brightness along x, horizontal lines along y
+    period_x, phase_x, score_x = _detect_axis(
+        np.abs(np.diff(pixels, axis=1)).mean(axis=0))
+    period_y, phase_y, score_y = _detect_axis(
+        np.abs(np.diff(pixels, axis=0)).mean(axis=1))
+
+    cell_width = period_x * scale_x
+    cell_height = period_y * scale_y
+
+    return GridDetection(
+        cell_width=cell_width,
+        cell_height=cell_height,
+        offset_x=_full_size_offset(phase_x, scale_x, cell_width),
+        offset_y=_full_size_offset(phase_y, scale_y, cell_height),
+        columns=round(width / cell_width) if cell_width else 0,
+        rows=round(height / cell_height) if cell_height else 0,
+        confidence=min(score_x, score_y),
+    )
+
+
+def detect_image_grid(*, img_metadata: ImageMetadata,
+                      max_size: int = DETECT_MAX_SIZE,
+                      min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+                      max_bytes: int = DEFAULT_MAX_BYTES
+                      ) -> Union[GridDetection, None]:
+    """Detects an image's grid and stores it in its metadata.
+
+    `grid_confidence` is always set. The columns, rows, cell size and offsets
+    are only set when the confidence is at least `min_confidence`; images
+    below it should be sent to Vertex AI for predictions instead.
+
+    Arguments:
+        img_metadata (ImageMetadata): the image, with a local path
+        max_size (int): Optional. The longest side of the downscaled image
+        max_bytes (int): Optional. The most memory decoding the image may use
+        min_confidence (float): Optional. The lowest confidence to accept
+        max_bytes (int): Optional. The most memory decoding the image may use
+
+    Returns:
+        GridDetection, or None if the image couldn't be read, or decoded
+        within `max_bytes`
+    """
+    try:
+        detection = detect_grid(img_metadata.path, max_size=max_size,
+                                max_bytes=max_bytes)
+    except Exception as e:
+        print(f"Error: {e}\n{img_metadata.path}")
+        img_metadata.grid_confidence = 0.0
+        return None
+
+    img_metadata.grid_confidence = detection.confidence
+    if detection.confidence < min_confidence:
+        return detection
+
+    # Setting columns and rows recalculates the cell size, so the detected
+    # cell size is set afterwards
+    img_metadata.columns = detection.columns
+    img_metadata.rows = detection.rows
+    img_metadata.cell_width = round(detection.cell_width)
+    img_metadata.cell_height = round(detection.cell_height)
+    img_metadata.cell_offset_x = round(detection.offset_x) % max(
+        img_metadata.cell_width, 1)
+    img_metadata.cell_offset_y = round(detection.offset_y) % max(
+        img_metadata.cell_height, 1)
+
+    return detection
+
+
+def _detect_axis(profile: np.ndarray):
+    """PRIVATE. Finds the period, phase and strength of a line profile."""
+    size = len(profile)
+    max_period = size // MIN_CELLS
+    if max_period <= MIN_PERIOD:
+        return (0.0, 0.0, 0.0)
+
+    # High-pass filter, so that only thin lines are left, then blur them a
+    # little so that periods that aren't a whole number of pixels still
+    # make a single autocorrelation peak
+    window = np.ones(SMOOTHING_WINDOW) / SMOOTHING_WINDOW
+    profile = profile - np.convolve(profile, window, mode="same")
+    profile = np.convolve(profile, LINE_BLUR, mode="same")
+    profile = profile - profile.mean()
+
+    # Autocorrelation by FFT, zero-padded so it doesn't wrap around. Lags
+    # overlap less of the profile as they grow, so multiples of the period
+    # score a little lower than the period itself.
+    spectrum = np.fft.rfft(profile, 2 * size)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum))[:size]
+    if autocorr[0] <= 0:
+        return (0.0, 0.0, 0.0)
+    autocorr = autocorr / autocorr[0]
+
+    lags = np.arange(MIN_PERIOD, max_period + 1)
+    values = autocorr[lags]
+    is_peak = ((values >= autocorr[lags - 1]) &
+               (values >= autocorr[lags + 1]) & (values > 0))
+    if not is_peak.any():
+        return (0.0, 0.0, 0.0)
+
+    peaks = lags[is_peak]
+    heights = [_refine_peak(autocorr, lag)[1] for lag in peaks]
+    lag = int(peaks[np.argmax(heights)])
+    period = _refine_peak(autocorr, lag)[0]
+
+    # The score is the correlation of the overlapping parts of the profile
+    score = float(np.clip(autocorr[lag] * size / (size - lag), 0, 1))
+
+    # The peak of a multiple of the period pins it down more precisely
+    multiple = int((size // 2) / period)
+    if multiple >= 2:
+        near = int(round(multiple * period))
+        lo = max(near - 2, 1)
+        near = lo + int(np.argmax(autocorr[lo:near + 3]))
+        if 0 < near < size - 1:
+            period = _refine_peak(autocorr, near)[0] / multiple
+
+    # Each difference sits between two pixels
+    positions = np.arange(size) + 0.5
+    weights = np.maximum(profile, 0)
+    angles = 2 * np.pi * positions / period
+    phase = np.arctan2(np.dot(weights, np.sin(angles)),
+                       np.dot(weights, np.cos(angles)))
+    phase = float(phase / (2 * np.pi) * period)
+
+    # Fit the period and phase to the lines near where they're expected,
+    # so a small error in the period doesn't add up across the image
+    for _ in range(REFIT_ITERATIONS):
+        cells = np.floor((positions - phase) / period + 0.5)
+        residuals = positions - phase - cells * period
+        near = weights * (np.abs(residuals) <= LINE_HALF_WIDTH)
+        total = near.sum()
+        if total <= 0:
+            break
+
+        cells_mean = np.dot(near, cells) / total
+        residuals_mean = np.dot(near, residuals) / total
+        variance = np.dot(near, (cells - cells_mean) ** 2)
+        if variance <= 0:
+            break
+
+        slope = np.dot(near, (cells - cells_mean) *
+                       (residuals - residuals_mean)) / variance
+        period += float(slope)
+        phase += float(residuals_mean - slope * cells_mean)
+
+    return (period, phase % period, score)
+
+
+def _full_size_offset(phase: float, scale: float, cell_size: float) -> float:
+    """PRIVATE. Scales a downscaled pixel position up to the full image."""
+    if not cell_size:
+        return 0.0
+
+    # Pixel centers of the downscaled image sit in the middle of `scale`
+    # full size pixels
+    offset = ((phase + 0.5) * scale - 0.5) % cell_size
+    return 0.0 if offset >= cell_size else offset
+
+
+def _refine_peak(values: np.ndarray, index: int):
+    """PRIVATE. Finds the position and height of a peak with a parabola."""
+    before, peak, after = values[index - 1:index + 2]
+    curvature = before - 2 * peak + after
+    if curvature >= 0:
+        return (float(index), float(peak))
+
+    return (float(index + 0.5 * (before - after) / curvature),
+            float(peak - (before - after) ** 2 / (8 * curvature)))
+
+
+def _estimate_axis(mins: np.ndarray, maxes: np.ndarray):
+    """PRIVATE. Estimates the pitch and offset of a grid along one axis."""
+    pitch = float(np.median(maxes - mins))
+    if pitch <= 0:
+        raise ValueError("Can't estimate a grid from empty boxes")
+
+    # Group the sorted centers into columns (or rows) at every gap of at
+    # least half a cell, then step between the mean center of each group
+    centers = np.sort((mins + maxes) / 2)
+    groups = np.concatenate(([0], np.cumsum(
+        np.diff(centers) >= MIN_STEP_FRACTION * pitch)))
+    counts = np.bincount(groups)
+    means = np.bincount(groups, weights=centers) / counts
+    if len(means) > 1:
+        diffs = np.diff(means)
+        steps = np.maximum(np.rint(diffs / pitch), 1)
+        pitch = float(np.median(diffs / steps))
+
+    # The circular mean of the groups is the first guess at a cell center,
+    # corrected by the median distance of every box from its nearest cell
+    angles = 2 * np.pi * means / pitch
+    center = pitch * np.arctan2(np.dot(counts, np.sin(angles)),
+                                np.dot(counts, np.cos(angles))) / (2 * np.pi)
+    center += np.median(_residuals(centers, center, pitch))
+
+    # Refit the pitch and cell center to the boxes near a cell center
+    for _ in range(REFIT_ITERATIONS):
+        cells = np.rint((centers - center) / pitch)
+        is_inlier = (np.abs(_residuals(centers, center, pitch)) <
+                     INLIER_FRACTION * pitch)
+        cells = cells[is_inlier]
+        offsets = centers[is_inlier] - center
+        if cells.size < 2 or cells.min() == cells.max():
+            break
+
+        cells_mean = cells.mean()
+        offsets_mean = offsets.mean()
+        pitch = float(np.dot(cells - cells_mean, offsets - offsets_mean) /
+                      np.dot(cells - cells_mean, cells - cells_mean))
+        center += offsets_mean - pitch * cells_mean
+
+    # Cell centers fall half a cell after each grid line
+    offset = float(center - pitch / 2) % pitch
+
+    # A tiny negative phase can round up to a whole pitch
+    if offset >= pitch:
+        offset = 0.0
+
+    return (pitch, offset)
+
+
+def _residuals(centers: np.ndarray, center: float,
+               pitch: float) -> np.ndarray:
+    """PRIVATE. Gets the distance of each center from its nearest cell."""
+    return (centers - center + pitch / 2) % pitch - pitch / 2
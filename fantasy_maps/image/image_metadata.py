@@ -12,9 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import json
+import sys
 
+from collections.abc import Sequence as SequenceABC
 from dataclasses import dataclass, field
-from typing import Mapping, Union, Sequence
+from typing import Iterable, Iterator, List, Mapping, Union, Sequence
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Cached serialized forms, cleared whenever an attribute is set
+_SERIALIZED_CACHE_ATTRS = ('_serialized_dict', '_serialized_json')
 
 
 @dataclass
@@ -38,6 +50,106 @@ class BBox:
         return str(self.to_dict())
 
 
+class BBoxCollection(SequenceABC):
+    """A compact, read-only sequence of bounding boxes.
+
+    Coordinates live in a single (N, 4) float array with columns
+    `x_min, x_max, y_min, y_max`, matching `BBox`. Labels are stored once in
+    an interned label table and referenced per box by index. `BBox` objects
+    are only created when an item is accessed or iterated over.
+    """
+
+    def __init__(self, coords: np.ndarray,
+                 label: Union[str, Sequence[str]] = 'grid_cell', *,
+                 label_ids: np.ndarray = None):
+        """Instantiates the BBoxCollection class
+
+        Arguments:
+            coords (np.ndarray): an (N, 4) array of x_min, x_max, y_min, y_max
+            label (str or list of str): a single label for every box, or
+                the label table when `label_ids` is provided
+            label_ids (np.ndarray): Optional. An index into the label table
+                for each box
+        """
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 4)
+
+        if isinstance(label, str):
+            label = (label,)
+        self.labels = tuple(sys.intern(str(lb)) for lb in label)
+
+        if label_ids is None:
+            label_ids = np.zeros(len(self.coords), dtype=np.int32)
+        self.label_ids = np.asarray(label_ids, dtype=np.int32)
+
+        if self.label_ids.shape != (len(self.coords),):
+            raise ValueError("label_ids must have one entry per bounding box")
+
+    @classmethod
+    def from_bboxes(cls, bboxes: Iterable[BBox]) -> 'BBoxCollection':
+        """Packs a sequence of BBox objects into a collection."""
+        if isinstance(bboxes, BBoxCollection):
+            return bboxes
+
+        table = {}
+        coords = []
+        label_ids = []
+        for b in bboxes:
+            coords.append((b.x_min, b.x_max, b.y_min, b.y_max))
+            label_ids.append(table.setdefault(b.label, len(table)))
+
+        return cls(np.array(coords, dtype=np.float64).reshape(-1, 4),
+                   list(table), label_ids=np.array(label_ids, dtype=np.int32))
+
+    def __len__(self) -> int:
+        return self.coords.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            x_min, x_max, y_min, y_max = self.coords[index].tolist()
+            return BBox(x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max,
+                        label=self.labels[self.label_ids[index]])
+
+        # Slices, boolean masks and index arrays return a new collection
+        return BBoxCollection(self.coords[index], self.labels,
+                              label_ids=self.label_ids[index])
+
+    def __iter__(self) -> Iterator[BBox]:
+        labels = self.labels
+        for (x_min, x_max, y_min, y_max), label_id in zip(
+                self.coords.tolist(), self.label_ids.tolist()):
+            yield BBox(x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max,
+                       label=labels[label_id])
+
+    def __repr__(self):
+        return f"BBoxCollection(len={len(self)}, labels={self.labels!r})"
+
+    def filter_label(self, label: str) -> 'BBoxCollection':
+        """Returns only the bounding boxes with the given label."""
+        if label not in self.labels:
+            return self[np.zeros(len(self), dtype=bool)]
+
+        return self[self.label_ids == self.labels.index(label)]
+
+    def to_dicts(self) -> List[Mapping[str, Union[float, str]]]:
+        """Converts every bounding box to the same dict shape as BBox."""
+        labels = self.labels
+        return [
+            {
+                'xMin': x_min,
+                'xMax': x_max,
+                'yMin': y_min,
+                'yMax': y_max,
+                'displayName': labels[label_id],
+            }
+            for (x_min, x_max, y_min, y_max), label_id in zip(
+                self.coords.tolist(), self.label_ids.tolist())
+        ]
+
+    def to_jsonl(self) -> str:
+        """Converts every bounding box to a line of JSON."""
+        return '\n'.join(json.dumps(d) for d in self.to_dicts())
+
+
 class ImageMetadata:
     '''Dataclass for storing information about a FantasyMap. 
     '''
@@ -56,11 +168,16 @@ class ImageMetadata:
     uid: str = ''
     parent_uid: str = ''
     is_shard: bool = False
-    bboxes: Sequence[BBox] = field(default_factory=list)
+    # Parent image pixels per shard pixel. Above 1 when the parent image was
+    # decoded at a reduced size to fit in memory.
+    shard_scale: float = 1.0
+    bboxes: Union[Sequence[BBox], BBoxCollection] = field(
+        default_factory=list)
     cell_width: int = 0
     cell_height: int = 0
     cell_offset_x: int = 0
     cell_offset_y: int = 0
+    grid_confidence: float = 0.0
     is_usable: bool = True
 
     def __init__(self, url: str, rid: str, title: str, **kwargs):
@@ -72,13 +189,53 @@ class ImageMetadata:
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name not in _SERIALIZED_CACHE_ATTRS:
+            self._clear_serialized()
+
     def to_dict(self) -> Mapping[str, Union[str, int, float, None]]:
-        bb = [b.to_dict() for b in self.bboxes]
-        vtt = self.to_vtt()
-        self_dict = self.__dict__
-        self_dict['bboxes'] = bb
-        self_dict['vtt'] = vtt
-        return self_dict
+        """Serializes this image's metadata as a new dict.
+
+        The serialized form is cached until an attribute is set. Changes made
+        in place, such as appending to `bboxes`, don't clear the cache; assign
+        the attribute again instead.
+
+        Returns:
+            A new dict. Nested values are shared with the cache, so don't
+            modify them.
+        """
+        serialized = self.__dict__.get('_serialized_dict')
+        if serialized is None:
+            vtt = self.to_vtt()
+            if isinstance(self.bboxes, BBoxCollection):
+                bb = self.bboxes.to_dicts()
+            else:
+                bb = [b.to_dict() for b in self.bboxes]
+
+            serialized = {k: v for k, v in self.__dict__.items()
+                          if k not in _SERIALIZED_CACHE_ATTRS}
+            serialized['bboxes'] = bb
+            serialized['vtt'] = vtt
+            self.__dict__['_serialized_dict'] = serialized
+
+        return dict(serialized)
+
+    def to_json_bytes(self) -> bytes:
+        """Serializes this image's metadata as UTF-8 encoded JSON.
+
+        Uses orjson when it's installed. The result is cached until an
+        attribute is set.
+        """
+        serialized = self.__dict__.get('_serialized_json')
+        if serialized is None:
+            if orjson is not None:
+                serialized = orjson.dumps(self.to_dict())
+            else:
+                serialized = json.dumps(self.to_dict()).encode('utf-8')
+            self.__dict__['_serialized_json'] = serialized
+
+        return serialized
 
     def __str__(self):
         return json.dumps(self.to_dict())
@@ -99,6 +256,10 @@ class ImageMetadata:
             'cellsOffsetY': self.cell_offset_y,
         }
 
+    def _clear_serialized(self):
+        for attr in _SERIALIZED_CACHE_ATTRS:
+            self.__dict__.pop(attr, None)
+
     def _calculate_cell_dimensions(self):
         if not (self._width and self._height and self._rows and self._columns):
             return
@@ -0,0 +1,150 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextlib
+import math
+import struct
+from typing import TYPE_CHECKING, Iterator, Tuple
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# The most memory a single decoded image may use, by default
+DEFAULT_MAX_BYTES = 1024 ** 3  # 1 GiB
+
+# JPEG images can be decoded at these fractions of their size directly,
+# without decoding the full size image first
+JPEG_DRAFT_FACTORS = (1, 2, 4, 8)
+
+# Modes that PIL stores with one byte per pixel; the rest use four
+_SINGLE_BYTE_MODES = frozenset(("1", "L", "P"))
+
+# Errors that Image.open() takes to mean a plugin doesn't recognize a file,
+# so it tries the next plugin
+_NOT_THIS_FORMAT_ERRORS = (SyntaxError, IndexError, TypeError, struct.error)
+
+
+@contextlib.contextmanager
+def open_large_image(path: str) -> Iterator['Image.Image']:
+    """Opens an image of any size, without PIL's decompression bomb check.
+
+    Only the image header is read. Use `decoded_bytes()` or
+    `load_bounded()` to check how much memory decoding it would take.
+    PIL's module-wide `Image.MAX_IMAGE_PIXELS` isn't changed, so other
+    threads still get the check.
+
+    Arguments:
+        path (str): the path to the image
+
+    Raises:
+        PIL.UnidentifiedImageError: if the image format isn't recognized
+    """
+    with _open_unchecked(path) as img:
+        yield img
+
+
+def _open_unchecked(path: str) -> 'Image.Image':
+    """PRIVATE. Opens an image the way Image.open() does, minus the check."""
+    from PIL import Image, UnidentifiedImageError
+
+    with open(path, "rb") as f:
+        prefix = f.read(16)
+
+    # Try the common formats first, then every plugin, as Image.open() does
+    checked = set()
+    for load_plugins in (Image.preinit, Image.init):
+        load_plugins()
+        for format_id in [i for i in Image.ID if i not in checked]:
+            checked.add(format_id)
+            factory, accept = Image.OPEN[format_id]
+            result = not accept or accept(prefix)
+            if not result or isinstance(result, str):
+                continue
+
+            try:
+                return factory(path)
+            except _NOT_THIS_FORMAT_ERRORS:
+                continue
+
+    raise UnidentifiedImageError(f"cannot identify image file {path!r}")
+
+
+def decoded_bytes(width: int, height: int, mode: str) -> int:
+    """Gets the memory PIL needs to hold a decoded image, in bytes."""
+    bytes_per_pixel = 1 if mode in _SINGLE_BYTE_MODES else 4
+    return width * height * bytes_per_pixel
+
+
+def load_bounded(
+    img: 'Image.Image',
+    *,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    reduce_factor: int = 1,
+) -> Tuple['Image.Image', Tuple[float, float]]:
+    """Decodes an image at the largest size that fits in `max_bytes`.
+
+    JPEG images are decoded straight to a smaller size with `draft()`, at
+    1/2, 1/4 or 1/8 scale, so the full size image is never held in memory.
+    PIL decodes other formats, such as PNG, in one piece, so they must fit
+    in `max_bytes` at full size.
+
+    Arguments:
+        img (PIL.Image.Image): an opened, but not yet loaded, image, such as
+            from `open_large_image()`
+        max_bytes (int): Optional. The most memory the decoded image may use
+        reduce_factor (int): Optional. Downscale the image to at most
+            1/reduce_factor of its full size, or further if it doesn't fit
+            in `max_bytes`
+
+    Returns:
+        Tuple of the decoded image and its scale, as a tuple of the full size
+        width divided by the decoded width and the full size height divided
+        by the decoded height
+
+    Raises:
+        ValueError: if the image can't be decoded within `max_bytes`
+    """
+    from PIL import Image
+
+    full_width, full_height = img.size
+    reduce_factor = max(reduce_factor, 1)
+
+    if img.format == "JPEG":
+        # Start from the draft scale that reduce_factor alone would use
+        first = max(f for f in JPEG_DRAFT_FACTORS if f <= reduce_factor)
+        for factor in (f for f in JPEG_DRAFT_FACTORS if f >= first):
+            needed = decoded_bytes(math.ceil(full_width / factor),
+                                   math.ceil(full_height / factor), img.mode)
+            if needed <= max_bytes:
+                break
+        else:
+            raise ValueError(f"Image needs {needed} bytes to decode at "
+                             f"1/{factor} scale, more than {max_bytes}")
+
+        if factor > 1:
+            img.draft(img.mode, (full_width // factor, full_height // factor))
+    else:
+        needed = decoded_bytes(full_width, full_height, img.mode)
+        if needed > max_bytes:
+            raise ValueError(f"Image needs {needed} bytes to decode, more "
+                             f"than {max_bytes}")
+
+    img.load()
+
+    # draft() only supports a few scales; resize the rest of the way
+    width = min(img.width, max(full_width // reduce_factor, 1))
+    height = min(img.height, max(full_height // reduce_factor, 1))
+    if (width, height) != img.size:
+        img = img.resize((width, height), Image.Resampling.BOX)
+
+    return (img, (full_width / img.width, full_height / img.height))
@@ -0,0 +1,201 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from itertools import groupby
+from typing import Iterable, List, Sequence
+
+import numpy as np
+
+from .catalog import (BOOL_FIELDS, FIELDS, FLOAT_FIELDS, INT_FIELDS,
+                      STRING_FIELDS)
+from .image_metadata import BBoxCollection, ImageMetadata
+
+BBOX_FIELDS = ('x_min', 'x_max', 'y_min', 'y_max')
+
+# The position of each row's image in the file, so images that share a uid,
+# or have none yet, are still read back separately
+IMAGE_INDEX_FIELD = 'image_index'
+
+
+def write_parquet(images: Iterable[ImageMetadata], path: str):
+    """Writes image metadata and bounding boxes to a Parquet file.
+
+    Each bounding box is one row, alongside the metadata of its image. An
+    image without bounding boxes is written as a single row with null
+    bounding box columns. Every row also has the `image_index` of its image.
+    Every parent image is written, together with its shards, as its own row
+    group, so filters on `uid`, `parent_uid` and `is_shard` can skip whole
+    row groups.
+
+    Arguments:
+        images (Iterable[ImageMetadata]): the images to write
+        path (str): the local path of the Parquet file
+    """
+    pa, pq = _import_pyarrow()
+
+    images = sorted(images, key=_parent_uid)
+    schema = _schema(pa)
+
+    with pq.ParquetWriter(path, schema) as writer:
+        start_index = 0
+        for _, group in groupby(images, key=_parent_uid):
+            group = list(group)
+            writer.write_table(_to_table(pa, schema, group,
+                                         start_index=start_index))
+            start_index += len(group)
+
+
+def read_parquet_table(path: str, *, columns: Sequence[str] = None,
+                       filters=None):
+    """Reads a Parquet file written by `write_parquet` as an Arrow table.
+
+    The file is memory-mapped rather than read into memory.
+
+    Arguments:
+        path (str): the local path of the Parquet file
+        columns (list): Optional. The columns to read. Defaults to all.
+        filters: Optional. Row filters in `pyarrow.parquet.read_table`
+            format, for example `[("is_shard", "=", False)]`
+
+    Returns:
+        pyarrow.Table
+    """
+    _, pq = _import_pyarrow()
+    return pq.read_table(path, columns=columns, filters=filters,
+                         memory_map=True)
+
+
+def read_parquet(path: str, *, filters=None) -> List[ImageMetadata]:
+    """Reads image metadata and bounding boxes from a Parquet file.
+
+    Arguments:
+        path (str): the local path of the Parquet file
+        filters: Optional. Row filters in `pyarrow.parquet.read_table`
+            format, for example `[("parent_uid", "=", "abc123")]`
+
+    Returns:
+        List of ImageMetadata, with bounding boxes as BBoxCollection
+    """
+    table = read_parquet_table(path, filters=filters)
+    if table.num_rows == 0:
+        return []
+
+    names = FIELDS + BBOX_FIELDS + ('label', IMAGE_INDEX_FIELD)
+    columns = {name: table.column(name).to_numpy(zero_copy_only=False)
+               for name in names}
+    has_bbox = ~table.column('x_min').is_null().to_numpy(
+        zero_copy_only=False)
+
+    # Each image's rows are contiguous, so split wherever the index changes
+    image_index = columns[IMAGE_INDEX_FIELD]
+    starts = np.flatnonzero(np.r_[True, image_index[1:] != image_index[:-1]])
+    ends = np.r_[starts[1:], len(image_index)]
+
+    coords = np.column_stack([columns[f] for f in BBOX_FIELDS])
+    labels, label_ids = np.unique(columns['label'][has_bbox].astype(str),
+                                  return_inverse=True)
+    all_label_ids = np.zeros(len(image_index), dtype=np.int32)
+    all_label_ids[has_bbox] = label_ids
+
+    images = []
+    for start, end in zip(starts, ends):
+        values = {name: columns[name][start] for name in FIELDS}
+        for name in INT_FIELDS + FLOAT_FIELDS + BOOL_FIELDS:
+            values[name] = values[name].item()
+
+        img = ImageMetadata(url=values.pop('url'), rid=values.pop('rid'),
+                            title=values.pop('title'), **values)
+
+        mask = has_bbox[start:end]
+        img.bboxes = BBoxCollection(coords[start:end][mask], list(labels),
+                                    label_ids=all_label_ids[start:end][mask])
+        images.append(img)
+
+    return images
+
+
+def _import_pyarrow():
+    """PRIVATE. Imports pyarrow, which is an optional dependency."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Parquet support requires pyarrow. Install it with "
+            "`pip install fantasy_maps_lib[parquet]`."
+        ) from e
+
+    return pa, pq
+
+
+def _parent_uid(img_metadata: ImageMetadata) -> str:
+    """PRIVATE. Gets the uid of the parent image, or of the image itself."""
+    if img_metadata.is_shard and img_metadata.parent_uid:
+        return img_metadata.parent_uid
+
+    return img_metadata.uid
+
+
+def _schema(pa):
+    """PRIVATE. Gets the Arrow schema of the exploded bounding box rows."""
+    fields = []
+    for name in FIELDS:
+        if name in STRING_FIELDS:
+            fields.append(pa.field(name, pa.string()))
+        elif name in INT_FIELDS:
+            fields.append(pa.field(name, pa.int64()))
+        elif name in FLOAT_FIELDS:
+            fields.append(pa.field(name, pa.float64()))
+        else:
+            fields.append(pa.field(name, pa.bool_()))
+
+    fields += [pa.field(name, pa.float64()) for name in BBOX_FIELDS]
+    fields.append(pa.field('label', pa.string()))
+    fields.append(pa.field(IMAGE_INDEX_FIELD, pa.int64()))
+
+    return pa.schema(fields)
+
+
+def _to_table(pa, schema, images: List[ImageMetadata], *,
+              start_index: int = 0):
+    """PRIVATE. Converts images into exploded bounding box rows."""
+    bboxes = [BBoxCollection.from_bboxes(img.bboxes) for img in images]
+
+    # Images without bounding boxes still get one row
+    counts = np.array([max(len(b), 1) for b in bboxes])
+
+    columns = {}
+    for name in FIELDS:
+        values = np.array([getattr(img, name) for img in images],
+                          dtype=object)
+        columns[name] = np.repeat(values, counts).tolist()
+
+    coords = []
+    labels = []
+    for b in bboxes:
+        if len(b) == 0:
+            coords.append(np.full((1, 4), np.nan))
+            labels.append([None])
+        else:
+            coords.append(b.coords)
+            labels.append(np.array(b.labels, dtype=object)[b.label_ids])
+
+    coords = np.concatenate(coords)
+    is_empty = np.repeat([len(b) == 0 for b in bboxes], counts)
+    for i, name in enumerate(BBOX_FIELDS):
+        columns[name] = pa.array(coords[:, i], mask=is_empty)
+    columns['label'] = np.concatenate(labels).tolist()
+    columns[IMAGE_INDEX_FIELD] = np.repeat(
+        np.arange(start_index, start_index + len(images)), counts)
+
+    return pa.table(columns, schema=schema)
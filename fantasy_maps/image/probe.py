@@ -0,0 +1,106 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import struct
+from typing import BinaryIO, Tuple, Union
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Start-of-frame markers carry the image dimensions. 0xC4 (DHT), 0xC8 (JPG)
+# and 0xCC (DAC) share the range but aren't frames.
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Markers without a length field
+JPEG_STANDALONE_MARKERS = frozenset(range(0xD0, 0xDA)) | {0x01}
+
+
+def probe_image_size(path: str) -> Union[Tuple[int, int], None]:
+    """Reads an image's width and height from its file header.
+
+    Only the header is parsed, without decoding or loading any image data.
+    JPEG, PNG and WebP files are supported.
+
+    Arguments:
+        path (str): the path to the image
+
+    Returns:
+        Tuple of width, height, or None if the header couldn't be parsed
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(32)
+
+            if head.startswith(b"\xff\xd8"):
+                f.seek(2)
+                return _probe_jpeg(f)
+
+            if head.startswith(PNG_SIGNATURE) and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+
+            if head[0:4] == b"RIFF" and head[8:12] == b"WEBP":
+                return _probe_webp(head)
+
+    except (OSError, struct.error):
+        pass
+
+    return None
+
+
+def _probe_jpeg(f: BinaryIO) -> Union[Tuple[int, int], None]:
+    """PRIVATE. Walks JPEG segments until it finds a start-of-frame."""
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+
+        marker = f.read(1)
+        # Any number of 0xFF fill bytes may precede a marker
+        while marker == b"\xff":
+            marker = f.read(1)
+        if not marker:
+            return None
+
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS or marker == 0x00:
+            continue
+
+        (length,) = struct.unpack(">H", f.read(2))
+        if marker in JPEG_SOF_MARKERS:
+            # precision (1 byte), then height and width
+            height, width = struct.unpack(">xHH", f.read(5))
+            return (width, height)
+
+        f.seek(length - 2, 1)
+
+
+def _probe_webp(head: bytes) -> Union[Tuple[int, int], None]:
+    """PRIVATE. Reads the dimensions from the first chunk of a WebP file."""
+    chunk = head[12:16]
+    data = head[20:]
+
+    if chunk == b"VP8 " and data[3:6] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", data[6:10])
+        return (width & 0x3FFF, height & 0x3FFF)
+
+    if chunk == b"VP8L" and data[0] == 0x2F:
+        (bits,) = struct.unpack("<I", data[1:5])
+        return ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+
+    if chunk == b"VP8X":
+        width = int.from_bytes(data[4:7], "little") + 1
+        height = int.from_bytes(data[7:10], "little") + 1
+        return (width, height)
+
+    return None
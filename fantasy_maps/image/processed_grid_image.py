@@ -1,12 +1,13 @@
-import imageio
-import imgaug as ia
-from imgaug.augmentables.bbs import BoundingBox, BoundingBoxesOnImage
+# imageio, imgaug and PIL are slow to import, so they are imported in the
+# methods that use them.
 import json
 import math
-import os
-import PIL
 
-from google.cloud import storage
+import numpy as np
+
+from fantasy_maps.gcp.clients import get_storage_client
+from fantasy_maps.image.grid import estimate_grid
+from fantasy_maps.image.large_image import open_large_image
 
 
 class ProcessedGridImage:
@@ -14,6 +15,11 @@ class ProcessedGridImage:
 
     This class combines image plotting features from imageio, imguag, and
     Pillow with extraction techniques for Vertex AI prediction outputs.
+
+    Bounding boxes are kept as (N, 4) NumPy arrays with x_min, x_max, y_min,
+    y_max columns: `prediction_boxes` holds the predictions as fractions of
+    the image size, while `bboxes_on_image` and `normalized_bboxes` are in
+    pixels. imgaug bounding boxes are only built to show the image.
     """
 
     CONFIDENCE_THRESHOLD = 0.7
@@ -38,8 +44,8 @@ class ProcessedGridImage:
           bboxes: the bounding boxes of the objects detected on the image
           confidences: the confidence scores of the objects detected
           on the image
-          drift_amount: a fudge factor for normalizing bounding boxes
-          outside of the bounds of the actual gridlines
+          drift_amount: the number of pixels to shrink each normalized
+          bounding box by, so that it stays inside the actual gridlines
           local_file_uri: the filepath to the image file, local file
           gcs_file_uri: the Cloud Storage URI (gs://) to the image file
 
@@ -52,14 +58,21 @@ class ProcessedGridImage:
         self.drift_amount = drift_amount
         self.local_file_uri = local_file_uri
         self.gcs_file_uri = gcs_file_uri
-        self.bboxes_on_image = []
-        self.normalized_bboxes = []
+        self.prediction_boxes = np.asarray(bboxes,
+                                           dtype=np.float64).reshape(-1, 4)
+        if len(confidences) != len(self.prediction_boxes):
+            raise ValueError(
+                f"Got {len(confidences)} confidences for "
+                f"{len(self.prediction_boxes)} bounding boxes"
+            )
+        self.bboxes_on_image = np.empty((0, 4))
+        self.normalized_bboxes = np.empty((0, 4))
         self.cell_width = 0
         self.cell_height = 0
         self.cell_width_percent = 0
         self.cell_height_percent = 0
-        self.cell_offset_x = 0  # Assuming a 0 offset map
-        self.cell_offset_y = 0  # Assuming a 0 offset map
+        self.cell_offset_x = 0
+        self.cell_offset_y = 0
 
         self._compute_actual_bboxes()
         self._compute_normalized_bboxes()
@@ -131,6 +144,8 @@ class ProcessedGridImage:
         *,
         training_data_file=None,
         use_prediction_results=True,
+        manifest_writer=None,
+        storage_client=None,
     ):
         """Saves image and bounding boxes as Vertex AI training data row.
 
@@ -143,17 +158,33 @@ class ProcessedGridImage:
                 args
             use_prediction_results: Optional. If false, the normalized results
                 for this image are stored as training data.
+            manifest_writer: Optional. A TrainingManifestWriter to append the
+                training data row to. If set, the row is buffered and written
+                as part of a manifest shard instead of rewriting
+                training_data_file.
+            storage_client: Optional. The Cloud Storage client to use.
+                Defaults to the shared client.
         """
 
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(gcs_bucket)
-
         # Step 1. Save the image to GCS
         if not self.local_file_uri and not self.gcs_file_uri:
             raise AttributeError("Neither local nor GCS URI set")
 
         elif not self.gcs_file_uri:
-            self.upload_local_image_to_gcs(gcs_bucket, gcs_prefix)
+            self.upload_local_image_to_gcs(gcs_bucket, gcs_prefix,
+                                           storage_client=storage_client)
+
+        if manifest_writer is not None:
+            data_row = {
+                "imageGcsUri": self.gcs_file_uri,
+                "boundingBoxAnnotations": self.bboxes,
+            }
+            manifest_writer.write(
+                self._prepare_data_for_training(data_row=data_row))
+            return
+
+        storage_client = storage_client or get_storage_client()
+        bucket = storage_client.bucket(gcs_bucket)
 
         # Step 2. Determine whether the training manifest file exists already
         if training_data_file:
@@ -196,14 +227,17 @@ class ProcessedGridImage:
         updated_training_data_file = bucket.blob(training_data_file)
         updated_training_data_file.upload_from_string(training_data)
 
-    def upload_local_image_to_gcs(self, gcs_bucket, gcs_prefix):
+    def upload_local_image_to_gcs(self, gcs_bucket, gcs_prefix, *,
+                                  storage_client=None):
         """Saves a copy of this file to Google Cloud Storage.
 
         Args:
             gcs_bucket: the bucket to store the image to
             gcs_prefix: the folder in the bucket to save to.
+            storage_client: Optional. The Cloud Storage client to use.
+                Defaults to the shared client.
         """
-        storage_client = storage.Client()
+        storage_client = storage_client or get_storage_client()
         file_name = self.local_file_uri.split("/")[-1]
         bucket = storage_client.bucket(gcs_bucket)
         blob = bucket.blob(f"{gcs_prefix}/{file_name}")
@@ -214,32 +248,31 @@ class ProcessedGridImage:
 
         self.gcs_file_uri = f"gs://{gcs_bucket}/{gcs_prefix}/{file_name}"
 
-    def download_gcs_image_to_local(self):
-        """Save an image from Cloud Storage to the local environment"""
-        storage_client = storage.Client()
+    def download_gcs_image_to_local(self, *, storage_client=None, cache=None):
+        """Save an image from Cloud Storage to the local environment
 
-        # Assume that the GCS URI was saved as 'gs://bucket/prefix/filename'
-        image_bucket_uri = self.gcs_file_uri.split("/")[0]
-        image_file_name = self.gcs_file_uri.split("/")[-1]
-        image_bucket = storage_client.bucket(image_bucket_uri)
+        The object is fetched directly by name from the bucket in
+        `gcs_file_uri`, and kept in a local disk cache so repeated downloads
+        of the same image are free.
 
-        # Ensure that the GCS image exists
-        blob_names = image_bucket.list_blobs()
-        filtered_blobs = filter(
-            lambda blob: blob.name.find(image_file_name) > -1, blob_names
-        )
+        Args:
+            storage_client: Optional. The Cloud Storage client to use.
+                Defaults to the shared client.
+            cache: Optional. The GcsImageCache to download into. Defaults to
+                the shared cache in "tmp/gcs-cache".
+        """
+        from google.api_core.exceptions import NotFound
 
-        if len(filtered_blobs) == 0:
-            raise NameError("Check image GCS URI")
+        from fantasy_maps.gcp.storage import get_image_cache
 
-        # Make a tmp directory
-        if not os.path.exists("tmp"):
-            os.mkdir("tmp")
+        if cache is None:
+            cache = get_image_cache()
 
-        # Download file to local
-        blob = filtered_blobs[0]
-        self.local_file_uri = f"tmp/{image_file_name}"
-        blob.download_to_filename(self.local_file_uri)
+        try:
+            self.local_file_uri = cache.fetch(self.gcs_file_uri,
+                                              client=storage_client)
+        except (NotFound, ValueError) as e:
+            raise NameError(f"Check image GCS URI: {self.gcs_file_uri}") from e
 
     def _prepare_data_for_training(self, data_row):
         """Updates bounding box data for model training.
@@ -274,110 +307,107 @@ class ProcessedGridImage:
         """PRIVATE. Renders the image with bounding boxes overlaid on top.
 
         Args:
-          bboxes: the bounding boxes to draw on top
+          bboxes: the (N, 4) array of pixel bounding boxes to draw on top
         """
+        import imageio
+        import imgaug as ia
+        from imgaug.augmentables.bbs import BoundingBoxesOnImage
+
         ia.seed(1)
 
         image = imageio.imread(self.local_file_uri)
 
-        bbs = BoundingBoxesOnImage(bboxes, shape=image.shape)
+        # imgaug expects x1, y1, x2, y2 columns
+        bbs = BoundingBoxesOnImage.from_xyxy_array(
+            np.asarray(bboxes)[:, [0, 2, 1, 3]], shape=image.shape
+        )
         ia.imshow(bbs.draw_on_image(image, size=2))
 
     def _compute_grid_based_boxes(self):
         """PRIVATE. Calculates new boundings boxes based upon predicted
         grid-cell width and height
         """
-        grid_based_boxes = []
-        current_x = self.cell_offset_x
-        current_y = self.cell_offset_y
-
         grid_cell_width = math.floor(self.width / self.grid_cells_width)
         grid_cell_height = math.floor(self.height / self.grid_cells_height)
 
-        while current_x < self.width:
-            while current_y < self.height:
-                x_min = current_x
-                x_max = current_x + grid_cell_width
-                y_min = current_y
-                y_max = current_y + grid_cell_height
-
-                grid_based_boxes.append(
-                    BoundingBox(x1=x_min, x2=x_max, y1=y_min, y2=y_max)
-                )
-
-                current_y = current_y + grid_cell_height
-
-            current_x = current_x + grid_cell_width
-            current_y = self.cell_offset_y
-
-        return grid_based_boxes
+        return _tile_boxes(
+            width=self.width,
+            height=self.height,
+            offset_x=self.cell_offset_x,
+            offset_y=self.cell_offset_y,
+            step_x=grid_cell_width,
+            step_y=grid_cell_height,
+        )
 
     def _compute_normalized_bboxes(self):
-        """PRIVATE. Calculates new boundings boxes based upon averge size of
-        predicted bounding boxes.
+        """PRIVATE. Calculates new boundings boxes based upon the grid
+        inferred from the predicted bounding boxes.
         """
-        if self.bboxes_on_image is None:
-            self._compute_actual_bboxes()
-
-        # Assumption 1. The confidence scores are ordered High => Low
-        # Assumption 2. The confidences and bboxes arrays are in sync
-        # Assumption 3. The bboxes are perfect squares
-        # Assumption 4. The bboxes have a tendency to be larger than the actual
-        # grid squares
-        top_confidences = None
-        if len(self.confidences) > 10:
-            top_confidences = self.confidences[0:10]
-        else:
-            top_confidences = self.confidences
+        if len(self.prediction_boxes) == 0:
+            raise ValueError("No predicted bounding boxes")
 
-        widths = []
-        heights = []
-        for count, value in enumerate(top_confidences):
-            current_bbox = self.bboxes[count]
-            widths.append(current_bbox[1] - current_bbox[0])
-            heights.append(current_bbox[3] - current_bbox[2])
-
-        avg_width = sum(widths) / len(widths)
-        avg_height = sum(heights) / len(heights)
-
-        self.cell_width_percent = avg_width
-        self.cell_height_percent = avg_height
-
-        self.cell_width = math.ceil(self.cell_width_percent * self.width)
-        self.cell_height = math.ceil(self.cell_height_percent * self.height)
-
-        current_x = self.cell_offset_x
-        current_y = self.cell_offset_y
+        if len(self.bboxes_on_image) == 0:
+            self._compute_actual_bboxes()
 
-        while current_x < self.width:
-            while current_y < self.height:
-                x_min = current_x
-                x_max = current_x + self.cell_width - self.drift_amount
-                y_min = current_y
-                y_max = current_y + self.cell_height - self.drift_amount
+        # The grid estimate is the center-to-center pitch, so it isn't thrown
+        # off by predicted bboxes that are larger than the grid squares
+        grid = estimate_grid(self.bboxes_on_image,
+                             confidences=self.confidences,
+                             min_confidence=self.CONFIDENCE_THRESHOLD)
+
+        self.cell_width = max(round(grid.cell_width), 1)
+        self.cell_height = max(round(grid.cell_height), 1)
+        self.cell_width_percent = self.cell_width / self.width
+        self.cell_height_percent = self.cell_height / self.height
+        self.cell_offset_x = round(grid.offset_x) % self.cell_width
+        self.cell_offset_y = round(grid.offset_y) % self.cell_height
+
+        self.normalized_bboxes = _tile_boxes(
+            width=self.width,
+            height=self.height,
+            offset_x=self.cell_offset_x,
+            offset_y=self.cell_offset_y,
+            step_x=grid.cell_width,
+            step_y=grid.cell_height,
+            box_width=grid.cell_width - self.drift_amount,
+            box_height=grid.cell_height - self.drift_amount,
+        )
 
-                self.normalized_bboxes.append(
-                    BoundingBox(x1=x_min, x2=x_max, y1=y_min, y2=y_max)
-                )
+    def _compute_actual_bboxes(self):
+        """PRIVATE. Converts predicted bounding boxes as  pixel values"""
+        scale = np.array([self.width, self.width, self.height, self.height],
+                         dtype=np.float64)
+        self.bboxes_on_image = self.prediction_boxes * scale
 
-                current_y = current_y + self.cell_height - self.drift_amount
 
-            current_x = current_x + self.cell_width - self.drift_amount
-            current_y = self.cell_offset_y
+def _tile_boxes(*, width, height, offset_x, offset_y, step_x, step_y,
+                box_width=None, box_height=None):
+    """PRIVATE. Tiles an image with a grid of step_x by step_y pixels.
 
-    def _compute_actual_bboxes(self):
-        """PRIVATE. Converts predicted bounding boxes as  pixel values"""
-        self.bboxes_on_image = []
+    Boxes start at the offset and continue while they start inside the
+    image. They are ordered by column, then by row within each column. Each
+    box is box_width by box_height pixels, which default to the step.
 
-        for bbox in self.bboxes:
-            x_min = bbox[0] * self.width
-            x_max = bbox[1] * self.width
-            y_min = bbox[2] * self.height
-            y_max = bbox[3] * self.height
+    Returns:
+        (N, 4) array of x_min, x_max, y_min, y_max pixel values
+    """
+    box_width = step_x if box_width is None else box_width
+    box_height = step_y if box_height is None else box_height
+    if min(step_x, step_y, box_width, box_height) <= 0:
+        raise ValueError(f"Grid cells must be larger than 0 pixels, "
+                         f"not {box_width} x {box_height}")
+
+    x_min, y_min = np.meshgrid(
+        np.arange(offset_x, width, step_x),
+        np.arange(offset_y, height, step_y),
+        indexing="ij",
+    )
+    x_min = x_min.ravel()
+    y_min = y_min.ravel()
 
-            self.bboxes_on_image.append(
-                BoundingBox(x1=x_min, x2=x_max, y1=y_min, y2=y_max)
-            )
+    return np.column_stack(
+        (x_min, x_min + box_width, y_min, y_min + box_height)
+    ).astype(np.float64)
 
 
 def analyze_annotation_results(result, *, local_file_uri) -> ProcessedGridImage:
@@ -392,10 +422,9 @@ def analyze_annotation_results(result, *, local_file_uri) -> ProcessedGridImage:
     bboxes = result["prediction"]["bboxes"]
     confidences = result["prediction"]["confidences"]
 
-    # Use PIL to get the width and height of the image
-    image = PIL.Image.open(local_file_uri)
-    width, height = image.size
-    image.close()
+    # Only the header is read, so this works for images of any size
+    with open_large_image(local_file_uri) as image:
+        width, height = image.size
 
     return ProcessedGridImage(
         width=width,
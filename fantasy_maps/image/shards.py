@@ -11,13 +11,30 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from PIL import Image
-from typing import Iterable, Union, Dict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Tuple, Union, Dict
 import math
+import os
 import random
 
-from fantasy_maps.image.extract import convert_image_to_hash
+from fantasy_maps.image.extract import (
+    compute_bboxes,
+    convert_image_to_hash,
+    get_image_width_and_height,
+)
 from fantasy_maps.image.image_metadata import ImageMetadata
+from fantasy_maps.image.large_image import (
+    DEFAULT_MAX_BYTES,
+    load_bounded,
+    open_large_image,
+)
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Decoded RGBA pixels are the worst case for an image held in memory
+BYTES_PER_PIXEL = 4
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3  # 2 GiB
 
 
 def compute_shard_coordinates(
@@ -87,6 +104,9 @@ def create_shard(
 ) -> Union[ImageMetadata, None]:
     """Crops and saves an image.
 
+    To crop several shards from the same parent image, use `create_shards`,
+    which decodes the parent image only once.
+
     Arguments:
         x_min (int): the left-most point to crop, relative to the parent image
         y_min (int): the top-most point to crop, relative to the parent image
@@ -100,11 +120,72 @@ def create_shard(
         ImageMetadata object representing the new image shard
 
     """
-    d = None
+    return create_shards(
+        parent_img=parent_img,
+        coords=[(x_min, y_min, x_max, y_max, cols, rows)],
+    )[0]
+
+
+def create_shards(
+    *,
+    parent_img: ImageMetadata,
+    coords: Iterable[Tuple[int, int, int, int, int, int]],
+    reduce_factor: int = 1,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+) -> List[Union[ImageMetadata, None]]:
+    """Crops and saves many shards from one image, decoding it only once.
+
+    Arguments:
+        parent_img (ImageMetadata): metadata of the parent image
+        coords (list): tuples of (xMin, yMin, xMax, yMax, columns, rows),
+            relative to the parent image, as returned by
+            `compute_shard_coordinates`
+        reduce_factor (int): Optional. Downscales the shards by this factor.
+            For JPEG images, the parent image is decoded at the reduced size
+            with `draft()` rather than decoded in full and then resized.
+        max_bytes (int): Optional. The most memory the decoded parent image
+            may use. JPEG images too large for it are decoded, and their
+            shards cropped, at 1/2, 1/4 or 1/8 scale. Other formats that
+            don't fit aren't sharded.
+
+    Returns:
+        List of ImageMetadata objects representing the new image shards, in
+        the same order as `coords`. Each shard's `shard_scale` is the number
+        of parent image pixels per shard pixel. An entry is None if that
+        shard couldn't be created.
+    """
+    coords = list(coords)
     try:
+        with open_large_image(parent_img.path) as img:
+            img, scale = load_bounded(img, max_bytes=max_bytes,
+                                      reduce_factor=reduce_factor)
+            if scale != (1, 1):
+                # Shard sizes, and so their cells and bounding boxes, are
+                # all at the reduced scale, which is kept in shard_scale
+                print(f"Downsampled: {parent_img.path} to 1/{max(scale):.3g}"
+                      f" scale, {img.width}x{img.height}")
 
-        img = Image.open(parent_img.path)
-        shard = img.crop((int(x_min), int(y_min), int(x_max), int(y_max)))
+            return [_save_shard(img=img, coord=c, scale=scale,
+                                parent_img=parent_img) for c in coords]
+
+    except (SystemError, ValueError) as e:
+        print(f"Error: {e}\n{parent_img}")
+        return [None] * len(coords)
+
+
+def _save_shard(
+    *,
+    img: 'Image.Image',
+    coord: Tuple[int, int, int, int, int, int],
+    scale: Tuple[float, float],
+    parent_img: ImageMetadata,
+) -> Union[ImageMetadata, None]:
+    """PRIVATE. Crops a single shard from a decoded image and saves it."""
+    x_min, y_min, x_max, y_max, cols, rows = coord
+    scale_x, scale_y = scale
+    try:
+        shard = img.crop((int(x_min / scale_x), int(y_min / scale_y),
+                          int(x_max / scale_x), int(y_max / scale_y)))
 
         # Get new filepath name
         s_path = create_shard_path(
@@ -116,26 +197,26 @@ def create_shard(
         uid = convert_image_to_hash(shard.tobytes())
 
         shard.save(s_path)
-        d = ImageMetadata(
+        width, height = shard.size
+        return ImageMetadata(
             rid=parent_img.rid,
             title=parent_img.title,
             url=parent_img.url,
-            width=math.floor(x_max - x_min),
-            height=math.floor(y_max - y_min),
+            width=width,
+            height=height,
             columns=cols,
             rows=rows,
             uid=uid,
             path=s_path,
             is_shard=True,
-            parent_uid=parent_img.uid
+            parent_uid=parent_img.uid,
+            shard_scale=max(scale),
         )
 
     except SystemError:
         print(f"Error: {parent_img}, bounds: {x_max},{y_max}")
         return None
 
-    return d
-
 
 def create_shard_path(
     *, path: str, x_min: int, y_min: int, cols: int, rows: int
@@ -162,3 +243,119 @@ def create_shard_path(
     s_path = ".".join(paths)
     file_name_paths[-1] = s_path
     return "/".join(file_name_paths)
+
+
+def generate_shards(
+    *,
+    images: Iterable[ImageMetadata],
+    num_shards: int,
+    shard_cols: int = 20,
+    shard_rows: int = 20,
+    max_workers: int = None,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+) -> Iterator[ImageMetadata]:
+    """Creates shards for many images in parallel, across processes.
+
+    Parent images are decoded in a pool of worker processes. New images are
+    only submitted while the estimated decoded size of all in-flight images
+    fits within `memory_budget`, though a single image larger than the
+    budget is still processed on its own.
+
+    Arguments:
+        images (Iterable[ImageMetadata]): the parent images to shard
+        num_shards (int): the number of shards to create per parent image
+        shard_cols (int): the number of columns in resulting shards
+        shard_rows (int): the number of rows in resulting shards
+        max_workers (int): Optional. The number of worker processes. Defaults
+            to the number of CPUs.
+        memory_budget (int): Optional. The maximum number of bytes of decoded
+            images to have in flight at once
+        max_bytes (int): Optional. The most memory any one decoded image may
+            use. Larger images are decoded at a reduced size.
+
+    Returns:
+        Iterator of ImageMetadata for each shard, with bounding boxes, yielded
+        as soon as its parent image is done.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    images = iter(images)
+
+    pending = {}
+    in_flight = 0
+    next_img = next(images, None)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while next_img is not None or pending:
+            while next_img is not None and len(pending) < max_workers:
+                try:
+                    cost = min(_estimate_decoded_bytes(next_img), max_bytes)
+                except Exception as e:
+                    # Skip an unreadable image, as a failed worker would
+                    print(f"Error: {e}\n{next_img}")
+                    next_img = next(images, None)
+                    continue
+
+                if pending and in_flight + cost > memory_budget:
+                    break
+
+                future = executor.submit(
+                    _shard_image,
+                    next_img,
+                    num_shards=num_shards,
+                    shard_cols=shard_cols,
+                    shard_rows=shard_rows,
+                    max_bytes=max_bytes,
+                )
+                pending[future] = (next_img, cost)
+                in_flight += cost
+                next_img = next(images, None)
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                parent_img, cost = pending.pop(future)
+                in_flight -= cost
+
+                try:
+                    yield from future.result()
+                except Exception as e:
+                    print(f"Error: {e}\n{parent_img}")
+
+
+def _estimate_decoded_bytes(img_metadata: ImageMetadata) -> int:
+    """PRIVATE. Estimates the memory needed to decode an image."""
+    width, height = img_metadata.width, img_metadata.height
+    if not (width and height):
+        width, height = get_image_width_and_height(img_metadata.path)
+
+    return width * height * BYTES_PER_PIXEL
+
+
+def _shard_image(
+    img_metadata: ImageMetadata,
+    *,
+    num_shards: int,
+    shard_cols: int,
+    shard_rows: int,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+) -> List[ImageMetadata]:
+    """PRIVATE. Creates the shards and their bounding boxes for one image.
+
+    This runs in a worker process, so it must stay a module-level function.
+    """
+    coords = compute_shard_coordinates(
+        img_metadata=img_metadata,
+        num_shards=num_shards,
+        shard_cols=shard_cols,
+        shard_rows=shard_rows,
+    )
+    if not coords:
+        return []
+
+    shards = create_shards(parent_img=img_metadata, coords=coords,
+                           max_bytes=max_bytes)
+    shards = [s for s in shards if s is not None]
+    for shard_metadata in shards:
+        shard_metadata.bboxes = compute_bboxes(img_metadata=shard_metadata)
+
+    return shards
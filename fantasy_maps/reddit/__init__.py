@@ -0,0 +1,18 @@
+import importlib
+
+# Submodules are only imported when first accessed, since they pull in
+# slow-to-import dependencies.
+_SUBMODULES = frozenset((
+  'posts',
+))
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
@@ -11,13 +11,20 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from typing import Mapping, List, Union
-
-import praw
-import spacy
+from typing import Iterable, Mapping, List, Union
 
+# praw and spaCy are slow to import, so they are imported in the functions
+# that use them.
+import functools
 import re
 
+SPACY_MODEL = "en_core_web_sm"
+
+# Part-of-speech tags only need the tagger and attribute ruler
+UNUSED_PIPES = ["parser", "ner", "lemmatizer"]
+
+POS = ["PROPN", "NOUN", "ADJ"]
+
 
 def get_reddit_posts(reddit_credentials, subreddit_name, limit):
     """Gets the top (hot) posts from a subreddit.
@@ -32,6 +39,8 @@ def get_reddit_posts(reddit_credentials, subreddit_name, limit):
         List of Reddit API objects
     """
 
+    import praw
+
     reddit = praw.Reddit(
         client_id=reddit_credentials["client_id"],
         client_secret=reddit_credentials["secret"],
@@ -73,26 +82,40 @@ def make_nice_filename(name: str) -> str:
     Returns:
         String. Format is `<adj.>-<nouns>.<cols>x<rows>.jpg`
     """
-
-    dims = re.findall('\d+x\d+', name)
-    if len(dims) == 0:
+    dims = _get_dims(name)
+    if dims is None:
         return ""
 
-    dims = dims[0].split("x")
-    if len(dims) != 2:
-        return ""
+    return _make_filename(name, dims, get_tokens(name))
 
-    tokens = get_tokens(name)
-    new_name = name.lower()[:30]
 
-    if len(tokens) > 0:
-        tokens = tokens[:6]  # Arbitrarily keep new names to six words or less
-        new_name = "_".join(tokens)
+def make_nice_filenames(titles: Iterable[str], *,
+                        batch_size: int = 256) -> List[str]:
+    """Converts many Reddit post titles into meaningful(ish) filenames.
 
-    # Remove any sensitive characters
-    new_name = re.sub(r'[\/|;|\']+', '', new_name)
+    The titles are analyzed together in batches, which is much faster than
+    calling `make_nice_filename` for each title.
 
-    return f"{new_name}.{dims[0]}x{dims[1]}.jpg"
+    Arguments:
+        titles (Iterable[str]): titles of the posts
+        batch_size (int): Optional. The number of titles to analyze at once
+
+    Returns:
+        List of string, in the same order as `titles`. Format is
+        `<adj.>-<nouns>.<cols>x<rows>.jpg`, or "" for titles without grid
+        dimensions.
+    """
+    titles = list(titles)
+    all_dims = [_get_dims(t) for t in titles]
+    filenames = [""] * len(titles)
+
+    indices = [i for i, dims in enumerate(all_dims) if dims is not None]
+    docs = get_nlp().pipe((titles[i] for i in indices), batch_size=batch_size)
+
+    for i, doc in zip(indices, docs):
+        filenames[i] = _make_filename(titles[i], all_dims[i], _get_words(doc))
+
+    return filenames
 
 
 def get_tokens(title: str) -> List[str]:
@@ -104,18 +127,54 @@ def get_tokens(title: str) -> List[str]:
     Returns:
         List of string. Words to use in a filename.
     """
-    POS = ["PROPN", "NOUN", "ADJ"]
+    return _get_words(get_nlp()(title))
+
+
+@functools.lru_cache(maxsize=None)
+def get_nlp(model: str = SPACY_MODEL):
+    """Loads a spaCy pipeline, once per process.
+
+    Only the pipes needed for part-of-speech tags are loaded.
+
+    Arguments:
+        model (str): Optional. The name of the spaCy pipeline to load
+
+    Returns:
+        spacy.language.Language
+    """
+    import spacy
 
     spacy.prefer_gpu()
-    nlp = spacy.load("en_core_web_sm")
+    return spacy.load(model, exclude=UNUSED_PIPES)
+
 
-    words = []
+def _get_dims(name: str) -> Union[List[str], None]:
+    """PRIVATE. Finds the `<cols>x<rows>` grid dimensions in a title."""
+    dims = re.findall(r'\d+x\d+', name)
+    if len(dims) == 0:
+        return None
+
+    dims = dims[0].split("x")
+    if len(dims) != 2:
+        return None
 
-    tokens = nlp(title)
-    for t in tokens:
-        pos = t.pos_
+    return dims
+
+
+def _make_filename(name: str, dims: List[str], tokens: List[str]) -> str:
+    """PRIVATE. Builds a filename from a title, its dimensions and tokens."""
+    new_name = name.lower()[:30]
+
+    if len(tokens) > 0:
+        tokens = tokens[:6]  # Arbitrarily keep new names to six words or less
+        new_name = "_".join(tokens)
+
+    # Remove any sensitive characters
+    new_name = re.sub(r'[\/|;|\']+', '', new_name)
+
+    return f"{new_name}.{dims[0]}x{dims[1]}.jpg"
 
-        if pos in POS:
-            words.append(t.text.lower())
 
-    return words
+def _get_words(doc) -> List[str]:
+    """PRIVATE. Gets the nouns, proper nouns, and adjectives in a doc."""
+    return [t.text.lower() for t in doc if t.pos_ in POS]
@@ -16,6 +16,7 @@ import re
 
 from fantasy_maps.reddit import posts
 from fantasy_maps.image import converter, extract, shards
+from fantasy_maps.image import ImageCatalog
 from fantasy_maps.image.image_metadata import ImageMetadata
 
 SUBREDDIT = "battlemaps"
@@ -144,41 +145,21 @@ def test_end_to_end_post_to_data(reddit_credentials,
 
     # endregion
 
-    actual_img_metadata = [i for i in actual_img_metadata if i.is_usable]
+    catalog = ImageCatalog.from_metadata(actual_img_metadata)
 
-    assert actual_img_metadata
+    assert catalog.is_usable.any()
+
+    actual_big_images = catalog[catalog.is_usable & (catalog.cells >= 500)]
+
+    assert len(actual_big_images) > 0
+
+    for shard_metadata in shards.generate_shards(images=actual_big_images,
+                                                 num_shards=NUM_SHARDS,
+                                                 shard_cols=SHARD_COLS,
+                                                 shard_rows=SHARD_ROWS):
+        actual_img_metadata.append(shard_metadata)
 
-    actual_big_images = [i for i
-                         in actual_img_metadata
-                         if (i.columns * i.rows) >= 500]
-
-    assert actual_big_images
-
-    for img_metadata in actual_big_images:
-        smaller_images = shards.compute_shard_coordinates(
-            img_metadata=img_metadata,
-            num_shards=NUM_SHARDS,
-            shard_cols=SHARD_COLS,
-            shard_rows=SHARD_ROWS)
-
-        for sm_img in smaller_images:
-            print(img_metadata.path)
-            print(sm_img)
-            shard_metadata = shards.create_shard(x_min=sm_img[0],
-                                                 y_min=sm_img[1],
-                                                 x_max=sm_img[2],
-                                                 y_max=sm_img[3],
-                                                 cols=sm_img[4],
-                                                 rows=sm_img[5],
-                                                 parent_img=img_metadata)
-
-            if shard_metadata is None:
-                continue
-
-            bboxes = extract.compute_bboxes(img_metadata=shard_metadata)
-            shard_metadata.bboxes = bboxes
-            actual_img_metadata.append(shard_metadata)
-
-            assert shard_metadata
-            assert shard_metadata.uid != ""
-            assert shard_metadata.path != ""
\ No newline at end of file
+        assert shard_metadata
+        assert len(shard_metadata.bboxes) > 0
+        assert shard_metadata.uid != ""
+        assert shard_metadata.path != ""
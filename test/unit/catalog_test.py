@@ -0,0 +1,78 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import copy
+import pickle
+
+import numpy as np
+import pytest
+
+from fantasy_maps.image import ImageCatalog, ImageMetadata
+from fantasy_maps.image.catalog import FIELDS
+
+
+@pytest.fixture
+def images():
+    dims = [(10, 10), (30, 45), (50, 50), (17, 22)]
+    images = [ImageMetadata(url=f"url-{n}", rid=f"rid-{n}",
+                            title=f"map {n}", uid=f"uid-{n}",
+                            width=cols * 40, height=rows * 40,
+                            columns=cols, rows=rows)
+              for n, (cols, rows) in enumerate(dims)]
+    images[2].is_usable = False
+    return images
+
+
+def test_image_catalog_round_trip(images):
+    catalog = ImageCatalog.from_metadata(images)
+    assert len(catalog) == 4
+
+    actual_img = catalog[1]
+    assert isinstance(actual_img, ImageMetadata)
+    for field in FIELDS:
+        assert getattr(actual_img, field) == getattr(images[1], field)
+    assert [i.uid for i in catalog.to_metadata()] == [i.uid for i in images]
+
+
+def test_image_catalog_vectorized_filters(images):
+    catalog = ImageCatalog.from_metadata(images)
+
+    assert list(catalog.cells) == [100, 1350, 2500, 374]
+
+    actual_big = catalog[catalog.is_usable & (catalog.cells >= 500)]
+    assert isinstance(actual_big, ImageCatalog)
+    assert list(actual_big.uid) == ["uid-1"]
+
+    actual_usable = catalog.filter(catalog.is_usable)
+    assert len(actual_usable) == 3
+    assert list(catalog[1:3].rid) == ["rid-1", "rid-2"]
+
+
+def test_image_catalog_keeps_cell_dimensions(images):
+    images[0].cell_width = 37
+    catalog = ImageCatalog.from_metadata(images)
+
+    assert catalog.cell_width.dtype == np.int64
+    assert catalog[0].cell_width == 37
+    with pytest.raises(AttributeError):
+        catalog.not_a_field
+
+
+def test_image_catalog_pickle(images):
+    catalog = ImageCatalog.from_metadata(images)
+
+    for actual in (pickle.loads(pickle.dumps(catalog)), copy.copy(catalog),
+                   copy.deepcopy(catalog)):
+        assert len(actual) == 4
+        assert list(actual.uid) == list(catalog.uid)
+        assert list(actual.is_usable) == list(catalog.is_usable)
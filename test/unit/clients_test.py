@@ -0,0 +1,78 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import pathlib
+import threading
+
+from fantasy_maps.gcp import storage
+from fantasy_maps.gcp.clients import ClientRegistry, FIRESTORE, STORAGE
+from fantasy_maps.image import ImageMetadata
+
+
+def test_client_registry_caches_per_project():
+    created = []
+    registry = ClientRegistry()
+    registry.set_factory(STORAGE, lambda project: created.append(project)
+                         or object())
+
+    actual_client = registry.storage("project-a")
+    assert registry.storage("project-a") is actual_client
+    assert registry.storage("project-b") is not actual_client
+    assert created == ["project-a", "project-b"]
+
+    registry.clear()
+    assert registry.storage("project-a") is not actual_client
+
+
+def test_client_registry_is_thread_safe():
+    created = []
+    registry = ClientRegistry()
+    registry.set_factory(FIRESTORE, lambda project: created.append(project)
+                         or object())
+
+    clients = []
+    threads = [threading.Thread(
+        target=lambda: clients.append(registry.firestore("project")))
+        for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(created) == 1
+    assert all(c is clients[0] for c in clients)
+
+
+def test_client_registry_register_fake():
+    registry = ClientRegistry()
+    fake_client = object()
+    registry.register(STORAGE, fake_client, project="project")
+
+    assert registry.storage("project") is fake_client
+
+
+def test_store_image_gcs_with_client(fake_storage_client):
+    img_path = os.path.join(pathlib.Path(__file__).parent.resolve(),
+                            "../resources/gridded-ruined-keep.jpg")
+    img = ImageMetadata(url="dummy-url", rid="dummyId", title="dummy",
+                        path=img_path)
+
+    actual_uri = storage.store_image_gcs(
+        project_id="project", img_metadata=img, bucket_name="fake-bucket",
+        prefix="maps", client=fake_storage_client,
+    )
+
+    assert actual_uri == "gs://fake-bucket/maps/gridded-ruined-keep.jpg"
+    assert fake_storage_client.bucket("fake-bucket").blob(
+        "maps/gridded-ruined-keep.jpg").exists()
@@ -0,0 +1,133 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import base64
+import hashlib
+import os
+import shutil
+
+import pytest
+from google.api_core import exceptions
+
+
+class FakeBlob:
+    """A stand-in for google.cloud.storage.Blob, backed by a local file."""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.root, name)
+
+    @property
+    def md5_hash(self):
+        with open(self.path, "rb") as f:
+            return base64.b64encode(hashlib.md5(f.read()).digest()).decode()
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def upload_from_string(self, data, content_type=None,
+                           if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._check_generation(if_generation_match)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def upload_from_filename(self, filename, if_generation_match=None):
+        self._check_generation(if_generation_match)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(filename, self.path)
+
+    def download_as_bytes(self):
+        if not self.exists():
+            raise exceptions.NotFound(self.name)
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def download_to_filename(self, filename):
+        if not self.exists():
+            raise exceptions.NotFound(self.name)
+        shutil.copyfile(self.path, filename)
+
+    def compose(self, sources):
+        data = b"".join(s.download_as_bytes() for s in sources)
+        self.upload_from_string(data)
+
+    def _check_generation(self, if_generation_match):
+        if if_generation_match == 0 and self.exists():
+            raise exceptions.PreconditionFailed(self.name)
+
+
+class FakeBucket:
+    """A stand-in for google.cloud.storage.Bucket, backed by a directory."""
+
+    def __init__(self, root, name="fake-bucket"):
+        self.root = root
+        self.name = name
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        blob = self.blob(name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix=None):
+        names = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                names.append(os.path.relpath(path, self.root))
+
+        return [self.blob(n) for n in sorted(names)
+                if prefix is None or n.startswith(prefix)]
+
+    def delete_blob(self, name):
+        os.remove(self.blob(name).path)
+
+
+class FakeStorageClient:
+    """A stand-in for google.cloud.storage.Client, backed by directories."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def bucket(self, name):
+        root = os.path.join(self.root, name)
+        os.makedirs(root, exist_ok=True)
+        return FakeBucket(root, name)
+
+    def get_bucket(self, name):
+        return self.bucket(name)
+
+    def list_blobs(self, bucket_or_name, prefix=None):
+        name = getattr(bucket_or_name, "name", bucket_or_name)
+        return self.bucket(name).list_blobs(prefix=prefix)
+
+
+@pytest.fixture
+def fake_storage_client(tmp_path):
+    root = tmp_path / "fake-storage"
+    root.mkdir()
+    return FakeStorageClient(str(root))
+
+
+@pytest.fixture
+def fake_bucket(fake_storage_client):
+    return fake_storage_client.bucket("fake-bucket")
@@ -11,6 +11,10 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import gzip
+import json
+
+import numpy as np
 import pytest
 
 from fantasy_maps.image import converter
@@ -54,6 +58,36 @@ def test_convert_fantasy_map_to_bounding_boxes(setup):
     assert actual_height == 2000
 
 
+def test_convert_fantasy_map_to_bounding_boxes_array(setup):
+    faked_input = setup[0]
+    expected_bboxes, _, _, _ = (
+        converter.convert_fantasy_map_to_bounding_boxes(faked_input)
+    )
+    actual_array, _, _, _ = converter.convert_fantasy_map_to_bounding_boxes(
+        faked_input, output="array"
+    )
+    actual_float32, _, _, _ = converter.convert_fantasy_map_to_bounding_boxes(
+        faked_input, output="float32"
+    )
+
+    assert actual_array.shape == (324, 4)
+    assert actual_array.dtype == np.float64
+    assert actual_float32.dtype == np.float32
+    assert actual_array[0].tolist() == [
+        expected_bboxes[0]["xMin"],
+        expected_bboxes[0]["xMax"],
+        expected_bboxes[0]["yMin"],
+        expected_bboxes[0]["yMax"],
+    ]
+    # Cells are ordered by column first
+    assert actual_array[1, 0] == actual_array[0, 0]
+    assert actual_array[1, 2] > actual_array[0, 2]
+
+    with pytest.raises(ValueError):
+        converter.convert_fantasy_map_to_bounding_boxes(faked_input,
+                                                       output="list")
+
+
 def test_convert_batch_predictions_to_training_data(setup):
     faked_prediction = setup[1]
     actual_train_data = converter.convert_batch_predictions_to_training_data(
@@ -61,3 +95,148 @@ def test_convert_batch_predictions_to_training_data(setup):
     )
 
     assert actual_train_data["imageGcsUri"].find(FAKED_FILE) != -1
+
+
+def test_convert_batch_prediction_file(setup, tmp_path):
+    faked_prediction = setup[1]
+    low_confidence_prediction = {
+        "instance": {"content": "gs://fake-bucket/fake-prefix/low.jpg"},
+        "prediction": {
+            "ids": [123],
+            "bboxes": [[0.1, 0.2, 0.1, 0.2]],
+            "confidences": [0.1],
+            "display_names": ["cell"],
+        },
+    }
+
+    input_path = tmp_path / "predictions_00001.jsonl.gz"
+    with gzip.open(input_path, "wt") as f:
+        for row in [faked_prediction, low_confidence_prediction, {}]:
+            f.write(json.dumps(row) + "\n")
+
+    output_path = tmp_path / "training.jsonl"
+    actual_stats = converter.convert_batch_prediction_file(
+        str(input_path), str(output_path)
+    )
+
+    assert actual_stats.rows_read == 3
+    assert actual_stats.rows_written == 1
+    assert actual_stats.rows_skipped == 2
+    assert actual_stats.kept_boxes == 1
+    assert actual_stats.dropped_boxes == 2
+
+    expected_row = converter.convert_batch_predictions_to_training_data(
+        faked_prediction
+    )
+    actual_rows = list(converter.read_jsonl(str(output_path)))
+    assert actual_rows == [expected_row]
+
+
+def test_convert_batch_prediction_file_malformed_line(setup, tmp_path,
+                                                     capsys):
+    input_path = tmp_path / "predictions_00001.jsonl"
+    input_path.write_text("\n".join([json.dumps(setup[1]), '{"instance": ',
+                                     json.dumps(setup[1])]) + "\n")
+
+    actual_rows = list(converter.read_jsonl(str(input_path)))
+    assert len(actual_rows) == 2
+    assert "Error" in capsys.readouterr().out
+
+    output_path = tmp_path / "training.jsonl"
+    actual_stats = converter.convert_batch_prediction_file(
+        str(input_path), str(output_path)
+    )
+
+    assert actual_stats.rows_read == 3
+    assert actual_stats.rows_written == 2
+    assert actual_stats.rows_skipped == 1
+
+
+def test_convert_batch_prediction_file_gzip_output(setup, tmp_path):
+    input_path = tmp_path / "predictions_00001.jsonl"
+    input_path.write_text(json.dumps(setup[1]) + "\n")
+
+    output_path = tmp_path / "training.jsonl.gz"
+    converter.convert_batch_prediction_file(str(input_path), str(output_path),
+                                            minimum_confidence_value=0.3)
+
+    with gzip.open(output_path, "rt") as f:
+        actual_row = json.loads(f.readline())
+    assert len(actual_row["boundingBoxAnnotations"]) == 2
+    assert actual_row["boundingBoxAnnotations"][1]["yMin"] == 0.3
+
+
+def test_convert_batch_prediction_files(setup, tmp_path):
+    faked_prediction = setup[1]
+    input_dir = tmp_path / "predictions"
+    input_dir.mkdir()
+
+    rows = []
+    for i in range(30):
+        row = json.loads(json.dumps(faked_prediction))
+        row["instance"]["content"] = f"gs://fake-bucket/fake-prefix/{i}.jpg"
+        rows.append(row)
+
+    with open(input_dir / "predictions_00001.jsonl", "w") as f:
+        for row in rows[:20]:
+            f.write(json.dumps(row) + "\n")
+    with gzip.open(input_dir / "predictions_00002.jsonl.gz", "wt") as f:
+        for row in rows[20:]:
+            f.write(json.dumps(row) + "\n")
+
+    output_path = tmp_path / "training.jsonl"
+    actual_stats = converter.convert_batch_prediction_files(
+        str(input_dir), str(output_path), max_workers=2, chunk_size=500
+    )
+
+    assert actual_stats.rows_read == 30
+    assert actual_stats.rows_written == 30
+    assert actual_stats.kept_boxes == 30
+    assert actual_stats.dropped_boxes == 30
+
+    actual_uris = [row["imageGcsUri"]
+                   for row in converter.read_jsonl(str(output_path))]
+    assert actual_uris == [row["instance"]["content"] for row in rows]
+
+
+def test_convert_batch_prediction_files_malformed_line(setup, tmp_path):
+    input_path = tmp_path / "predictions_00001.jsonl"
+    lines = [json.dumps(setup[1])] * 10
+    lines[4] = lines[4][:20]
+    input_path.write_text("\n".join(lines) + "\n")
+
+    output_path = tmp_path / "training.jsonl"
+    actual_stats = converter.convert_batch_prediction_files(
+        str(input_path), str(output_path), max_workers=2, chunk_size=500
+    )
+
+    assert actual_stats.rows_read == 10
+    assert actual_stats.rows_written == 9
+    assert actual_stats.rows_skipped == 1
+    assert len(list(converter.read_jsonl(str(output_path)))) == 9
+
+
+def test_main(setup, tmp_path):
+    input_path = tmp_path / "predictions_00001.jsonl"
+    input_path.write_text(json.dumps(setup[1]) + "\n")
+    output_path = tmp_path / "training.jsonl"
+
+    actual_code = converter.main([str(input_path), "-o", str(output_path),
+                                  "--workers", "1"])
+
+    assert actual_code == 0
+    assert len(list(converter.read_jsonl(str(output_path)))) == 1
+
+
+def test_main_no_input_files(tmp_path):
+    output_path = tmp_path / "training.jsonl"
+
+    with pytest.raises(FileNotFoundError):
+        converter.convert_batch_prediction_files(
+            str(tmp_path / "predictions_*.jsonl"), str(output_path))
+
+    actual_code = converter.main([str(tmp_path / "predictions_*.jsonl"),
+                                  "-o", str(output_path)])
+
+    assert actual_code != 0
+    assert not output_path.exists()
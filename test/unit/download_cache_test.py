@@ -0,0 +1,69 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import pytest
+
+from fantasy_maps.image.download_cache import DownloadCache
+
+UID = "9cfae11a756703b5c752f89611e08ddaee123149"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with DownloadCache(str(tmp_path / "cache")) as c:
+        yield c
+
+
+@pytest.fixture
+def downloaded_file(tmp_path):
+    path = tmp_path / "first.jpg"
+    path.write_bytes(b"not really a jpeg")
+    return str(path)
+
+
+def test_download_cache_add_and_lookup(cache, downloaded_file):
+    assert UID not in cache
+    assert cache.lookup("https://example.com/first.jpg") is None
+
+    cache.add(url="https://example.com/first.jpg", uid=UID,
+              path=downloaded_file)
+
+    assert UID in cache
+    assert cache.lookup("https://example.com/first.jpg") == UID
+    assert os.path.samefile(cache.object_path(UID), downloaded_file)
+
+
+def test_download_cache_links_duplicate_images(cache, downloaded_file,
+                                               tmp_path):
+    cache.add(url="https://example.com/first.jpg", uid=UID,
+              path=downloaded_file)
+
+    second_file = tmp_path / "second.jpg"
+    second_file.write_bytes(b"not really a jpeg")
+    cache.add(url="https://example.com/second.jpg", uid=UID,
+              path=str(second_file))
+
+    assert cache.lookup("https://example.com/second.jpg") == UID
+    assert os.path.samefile(downloaded_file, str(second_file))
+
+
+def test_download_cache_link(cache, downloaded_file, tmp_path):
+    cache.add(url="https://example.com/first.jpg", uid=UID,
+              path=downloaded_file)
+
+    actual_path = str(tmp_path / "linked.jpg")
+    cache.link(uid=UID, path=actual_path)
+
+    with open(actual_path, "rb") as f:
+        assert f.read() == b"not really a jpeg"
@@ -11,12 +11,17 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import functools
+import hashlib
+import http.server
 import os
 import math
 import pathlib
 import pytest
+import threading
 
 from fantasy_maps.image import extract, ImageMetadata
+from fantasy_maps.image.download_cache import DownloadCache
 
 IMG_URL = "https://i.redd.it/tnwu13fdki171.jpg"
 
@@ -29,6 +34,20 @@ def img_resource_dir():
     return test_image_dir
 
 
+@pytest.fixture
+def img_server(img_resource_dir):
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler,
+                                directory=img_resource_dir)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.fixture
 def img(img_resource_dir):
     test_image_url = os.path.join(img_resource_dir, "small_cemetary.17x22.jpg")
@@ -78,6 +97,144 @@ def test_download_image_local(img_resource_dir):
     assert actual_uid
 
 
+def test_download_image_local_streaming(img_server, img, tmp_path):
+    path = str(tmp_path / "small_cemetary.17x22.jpg")
+    actual_uid = extract.download_image_local(
+        url=f"{img_server}/small_cemetary.17x22.jpg", path=path, chunk_size=1024
+    )
+
+    with open(img.path, "rb") as f:
+        expected_content = f.read()
+
+    assert actual_uid == hashlib.sha1(expected_content).hexdigest()
+    with open(path, "rb") as f:
+        assert f.read() == expected_content
+
+    # Only the finished download is left behind
+    assert os.listdir(tmp_path) == ["small_cemetary.17x22.jpg"]
+
+
+def test_download_image_local_not_found(img_server, tmp_path):
+    path = str(tmp_path / "missing.jpg")
+    actual_uid = extract.download_image_local(url=f"{img_server}/missing.jpg",
+                                              path=path)
+    assert actual_uid == ""
+    assert not os.path.exists(path)
+
+
+def test_download_image_local_cached(img_server, tmp_path):
+    url = f"{img_server}/small_cemetary.17x22.jpg"
+    cache = DownloadCache(str(tmp_path / "cache"))
+
+    first_path = str(tmp_path / "first.jpg")
+    expected_uid = extract.download_image_local(url=url, path=first_path,
+                                                cache=cache)
+    assert expected_uid in cache
+
+    # Nothing is listening on this port, so this must come from the cache
+    cache.add(url="http://127.0.0.1:1/mirror.jpg", uid=expected_uid,
+              path=first_path)
+    second_path = str(tmp_path / "second.jpg")
+    actual_uid = extract.download_image_local(
+        url="http://127.0.0.1:1/mirror.jpg", path=second_path, cache=cache
+    )
+
+    assert actual_uid == expected_uid
+    assert os.path.samefile(first_path, second_path)
+    cache.close()
+
+
+def test_download_images_local(img_server, tmp_path):
+    names = ["small_cemetary.17x22.jpg", "gridded-ruined-keep.jpg",
+             "missing.jpg"]
+    images = [ImageMetadata(url=f"{img_server}/{n}", rid=n, title=n)
+              for n in names]
+
+    actual_images = extract.download_images_local(
+        images, directory=str(tmp_path), per_host_limit=2, backoff=0
+    )
+    assert [i.rid for i in actual_images] == names[:2]
+
+    for actual_img in actual_images:
+        assert actual_img.uid != ""
+        assert os.path.exists(actual_img.path)
+
+    assert images[2].uid == ""
+
+
+def test_download_images_local_timeout(tmp_path):
+    attempts = []
+    release = threading.Event()
+
+    class StalledHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            attempts.append(self.path)
+            release.wait(10)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                             StalledHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    port = server.server_address[1]
+    try:
+        actual_images = extract.download_images_local(
+            [ImageMetadata(url=f"http://127.0.0.1:{port}/stalled.jpg",
+                           rid="dummyId", title="dummy")],
+            directory=str(tmp_path), retries=1, backoff=0,
+            timeout=(1, 0.2),
+        )
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
+
+    assert actual_images == []
+    assert len(attempts) == 2
+
+
+def test_download_images_local_write_error(img_server, tmp_path):
+    images = [ImageMetadata(url=f"{img_server}/gridded-ruined-keep.jpg",
+                            rid="dummyId", title="dummy")]
+
+    # The directory doesn't exist, so saving the image fails
+    actual_images = extract.download_images_local(
+        images, directory=str(tmp_path / "missing"), backoff=0
+    )
+    assert actual_images == []
+    assert images[0].uid == ""
+
+
+def test_download_images_local_retries(img_resource_dir, tmp_path):
+    attempts = []
+
+    class FlakyHandler(http.server.SimpleHTTPRequestHandler):
+        def do_GET(self):
+            attempts.append(self.path)
+            if len(attempts) == 1:
+                self.send_error(503)
+                return
+            super().do_GET()
+
+    handler = functools.partial(FlakyHandler, directory=img_resource_dir)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    port = server.server_address[1]
+    url = f"http://127.0.0.1:{port}/gridded-ruined-keep.jpg"
+    try:
+        actual_images = extract.download_images_local(
+            [ImageMetadata(url=url, rid="dummyId", title="dummy")],
+            directory=str(tmp_path), backoff=0,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert len(attempts) == 2
+    assert len(actual_images) == 1
+    assert actual_images[0].uid != ""
+
+
 def test_get_image_width_and_height(img):
     width, height = extract.get_image_width_and_height(img.path)
     assert width == img.width
@@ -118,3 +275,20 @@ def test_compute_bboxes(img_metadata):
     assert math.isclose(actual_last_bbox.y_max, expected_y_max)
     assert math.isclose(actual_last_bbox.x_min, expected_x_min)
     assert math.isclose(actual_last_bbox.y_min, expected_y_min)
+
+
+def test_compute_bbox_array(img_metadata):
+    actual_coords = extract.compute_bbox_array(img_metadata=img_metadata)
+    assert actual_coords.shape == (12 * 18, 4)
+
+    actual_bboxes = extract.compute_bboxes(img_metadata=img_metadata)
+    assert len(actual_bboxes) == actual_coords.shape[0]
+
+    # The second box is one cell to the right of the first, on the same row
+    actual_second_bbox = actual_bboxes[1]
+    assert math.isclose(actual_second_bbox.x_min, 79 / 560)
+    assert math.isclose(actual_second_bbox.y_min, 39 / 800)
+    assert actual_second_bbox.label == "cell"
+
+    actual_last_bbox = list(actual_bboxes)[-1]
+    assert math.isclose(actual_last_bbox.x_max, actual_coords[-1][1])
@@ -0,0 +1,135 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+from google.api_core import exceptions
+
+from fantasy_maps.gcp import firestore
+from fantasy_maps.image import ImageMetadata
+
+
+class FakeDocument:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def set(self, data):
+        self.client.write(self.path, data)
+
+
+class FakeCollection:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def document(self, doc_id):
+        return FakeDocument(self.client, f"{self.name}/{doc_id}")
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref.path, data))
+
+    def commit(self):
+        self.client.commits += 1
+        if self.client.contended_commits > 0:
+            self.client.contended_commits -= 1
+            raise exceptions.Aborted("Too much contention")
+
+        # Batches are atomic, so validate every write before applying any
+        for path, data in self.writes:
+            self.client.validate(data)
+        for path, data in self.writes:
+            self.client.write(path, data)
+
+
+class FakeFirestoreClient:
+    """A stand-in for google.cloud.firestore.Client, backed by a dict."""
+
+    def __init__(self, contended_commits=0):
+        self.docs = {}
+        self.commits = 0
+        self.contended_commits = contended_commits
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def validate(self, data):
+        if data["title"] == "invalid":
+            raise exceptions.InvalidArgument("Invalid document")
+
+    def write(self, path, data):
+        self.validate(data)
+        self.docs[path] = data
+
+
+@pytest.fixture
+def images():
+    return [ImageMetadata(url="dummy-url", rid="dummyId", title=f"map {n}",
+                          uid=f"uid-{n}", path=f"maps/map_{n}.jpg")
+            for n in range(7)]
+
+
+def test_store_metadata_fs(images):
+    client = FakeFirestoreClient()
+    firestore.store_metadata_fs(project_id="project", img_metadata=images[0],
+                                collection_name="maps", client=client)
+
+    actual_doc = client.docs["maps/uid-0"]
+    assert actual_doc["filename"] == "map_0.jpg"
+    assert "path" not in actual_doc
+
+
+def test_store_metadata_fs_bulk(images):
+    client = FakeFirestoreClient()
+    actual_errors = firestore.store_metadata_fs_bulk(
+        project_id="project", images=images, collection_name="maps",
+        client=client, batch_size=3,
+    )
+
+    assert actual_errors == {}
+    assert client.commits == 3
+    assert sorted(client.docs) == [f"maps/uid-{n}" for n in range(7)]
+    assert client.docs["maps/uid-6"]["filename"] == "map_6.jpg"
+
+
+def test_store_metadata_fs_bulk_retries_contention(images):
+    client = FakeFirestoreClient(contended_commits=2)
+    actual_errors = firestore.store_metadata_fs_bulk(
+        project_id="project", images=images, collection_name="maps",
+        client=client, max_workers=1, backoff=0,
+    )
+
+    assert actual_errors == {}
+    assert client.commits == 3
+    assert len(client.docs) == 7
+
+
+def test_store_metadata_fs_bulk_reports_failed_records(images):
+    images[4].title = "invalid"
+    client = FakeFirestoreClient()
+    actual_errors = firestore.store_metadata_fs_bulk(
+        project_id="project", images=images, collection_name="maps",
+        client=client, batch_size=3, backoff=0,
+    )
+
+    assert list(actual_errors) == ["uid-4"]
+    assert isinstance(actual_errors["uid-4"], exceptions.InvalidArgument)
+    assert len(client.docs) == 6
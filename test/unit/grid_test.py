@@ -0,0 +1,189 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import pathlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from fantasy_maps.image import ImageMetadata, grid
+
+RESOURCES = os.path.join(pathlib.Path(__file__).parent.resolve(),
+                         "../resources/")
+
+CELL_WIDTH = 37.5
+CELL_HEIGHT = 40.0
+OFFSET_X = 12.0
+OFFSET_Y = 31.0
+
+
+@pytest.fixture
+def boxes():
+    rng = np.random.default_rng(42)
+    columns, rows = np.meshgrid(np.arange(25), np.arange(20), indexing="ij")
+    columns = columns.ravel()
+    rows = rows.ravel()
+
+    # Drop some cells, as the model misses a few
+    is_kept = rng.random(columns.size) > 0.3
+    columns = columns[is_kept]
+    rows = rows[is_kept]
+
+    x_min = OFFSET_X + columns * CELL_WIDTH
+    y_min = OFFSET_Y + rows * CELL_HEIGHT
+    boxes = np.column_stack((
+        x_min - 3, x_min + CELL_WIDTH + 3,
+        y_min - 3, y_min + CELL_HEIGHT + 3,
+    ))
+    boxes += rng.normal(0, 1, boxes.shape)
+    confidences = rng.uniform(0.7, 1.0, len(boxes))
+
+    # Confidently wrong boxes that span several cells
+    outliers = np.array([[0, 200, 0, 150], [500, 520, 300, 305]])
+    return (np.vstack((boxes, outliers)),
+            np.concatenate((confidences, [0.9, 0.8])))
+
+
+def test_estimate_grid(boxes):
+    actual_boxes, actual_confidences = boxes
+    actual_grid = grid.estimate_grid(actual_boxes,
+                                     confidences=actual_confidences,
+                                     min_confidence=0.5)
+
+    assert actual_grid.cell_width == pytest.approx(CELL_WIDTH, abs=0.2)
+    assert actual_grid.cell_height == pytest.approx(CELL_HEIGHT, abs=0.2)
+    assert actual_grid.offset_x == pytest.approx(OFFSET_X, abs=0.5)
+    assert actual_grid.offset_y == pytest.approx(OFFSET_Y, abs=0.5)
+
+
+def test_estimate_grid_ignores_low_confidence(boxes):
+    actual_boxes, actual_confidences = boxes
+    noise = np.array([[5, 300, 7, 400]] * 50)
+    actual_grid = grid.estimate_grid(
+        np.vstack((actual_boxes, noise)),
+        confidences=np.concatenate((actual_confidences, [0.1] * 50)),
+        min_confidence=0.5,
+    )
+
+    assert actual_grid.cell_width == pytest.approx(CELL_WIDTH, abs=0.2)
+
+
+def test_estimate_grid_offset_wraps():
+    actual_boxes = [[x - 1, x + 51, 0, 50] for x in range(0, 500, 50)]
+    actual_grid = grid.estimate_grid(actual_boxes)
+
+    assert actual_grid.cell_width == pytest.approx(50)
+    assert 0 <= actual_grid.offset_x < actual_grid.cell_width
+    assert min(actual_grid.offset_x, 50 - actual_grid.offset_x) < 1e-6
+
+
+def test_estimate_grid_no_boxes():
+    with pytest.raises(ValueError):
+        grid.estimate_grid(np.empty((0, 4)))
+
+
+@pytest.fixture
+def grid_image(tmp_path):
+    rng = np.random.default_rng(7)
+    pixels = rng.normal(150, 30, (1500, 2000))
+    pixels += 50 * np.sin(np.arange(2000) / 200)
+    for x in np.arange(OFFSET_X, 2000, 50.5).round().astype(int):
+        pixels[:, x:x + 2] = 20
+    for y in np.arange(OFFSET_Y, 1500, 50.5).round().astype(int):
+        pixels[y:y + 2, :] = 20
+
+    path = str(tmp_path / "grid.png")
+    Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(path)
+    return path
+
+
+def test_detect_grid(grid_image):
+    actual_grid = grid.detect_grid(grid_image)
+
+    assert actual_grid.cell_width == pytest.approx(50.5, abs=0.1)
+    assert actual_grid.cell_height == pytest.approx(50.5, abs=0.1)
+    assert actual_grid.offset_x == pytest.approx(OFFSET_X + 0.5, abs=1)
+    assert actual_grid.offset_y == pytest.approx(OFFSET_Y + 0.5, abs=1)
+    assert actual_grid.columns == 40
+    assert actual_grid.rows == 30
+    assert actual_grid.confidence > 0.7
+
+
+def test_detect_grid_resource():
+    actual_grid = grid.detect_grid(
+        os.path.join(RESOURCES, "gridded-ruined-keep.jpg"))
+
+    assert actual_grid.cell_width == pytest.approx(32, abs=0.2)
+    assert actual_grid.cell_height == pytest.approx(32, abs=0.2)
+    assert actual_grid.confidence > 0.7
+
+
+def test_detect_grid_large_image(grid_image, monkeypatch):
+    # Treat the image as a decompression bomb
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+
+    actual_grid = grid.detect_grid(grid_image)
+    assert actual_grid.cell_width == pytest.approx(50.5, abs=0.1)
+
+    # PNG images are decoded in one piece, so must fit in max_bytes
+    with pytest.raises(ValueError):
+        grid.detect_grid(grid_image, max_bytes=2000 * 1500 - 1)
+
+
+def test_detect_grid_no_grid(tmp_path):
+    rng = np.random.default_rng(7)
+    path = str(tmp_path / "noise.png")
+    pixels = rng.normal(128, 40, (800, 800)).clip(0, 255)
+    Image.fromarray(pixels.astype(np.uint8)).save(path)
+
+    actual_grid = grid.detect_grid(path)
+
+    assert actual_grid.confidence < grid.DEFAULT_MIN_CONFIDENCE
+
+
+def test_detect_image_grid(grid_image):
+    img_metadata = ImageMetadata(url="dummy-url", rid="dummyId",
+                                 title="dummy", path=grid_image)
+    img_metadata.width = 2000
+    img_metadata.height = 1500
+
+    actual_grid = grid.detect_image_grid(img_metadata=img_metadata)
+
+    assert img_metadata.grid_confidence == actual_grid.confidence
+    assert img_metadata.columns == 40
+    assert img_metadata.rows == 30
+    assert img_metadata.cell_width in (50, 51)
+    assert abs(img_metadata.cell_offset_x - (OFFSET_X + 0.5)) <= 1.5
+
+    missing = ImageMetadata(url="dummy-url", rid="dummyId", title="dummy",
+                            path="missing.png")
+    assert grid.detect_image_grid(img_metadata=missing) is None
+    assert missing.grid_confidence == 0.0
+    assert missing.columns == 1
+
+
+def test_detect_image_grid_max_bytes(grid_image):
+    img_metadata = ImageMetadata(url="dummy-url", rid="dummyId",
+                                 title="dummy", path=grid_image)
+
+    # The grayscale PNG needs 2000 * 1500 bytes to decode
+    actual_grid = grid.detect_image_grid(img_metadata=img_metadata,
+                                         max_bytes=2000 * 1500 - 1)
+    assert actual_grid is None
+    assert img_metadata.grid_confidence == 0.0
+
+    actual_grid = grid.detect_image_grid(img_metadata=img_metadata,
+                                         max_bytes=2000 * 1500)
+    assert actual_grid.confidence > 0.7
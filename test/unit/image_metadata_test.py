@@ -0,0 +1,98 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+import numpy as np
+import pytest
+
+from fantasy_maps.image import BBox, BBoxCollection, ImageMetadata
+
+
+@pytest.fixture
+def bboxes():
+    return [
+        BBox(x_min=0.1, x_max=0.2, y_min=0.1, y_max=0.2, label="cell"),
+        BBox(x_min=0.2, x_max=0.3, y_min=0.1, y_max=0.2, label="door"),
+        BBox(x_min=0.3, x_max=0.4, y_min=0.1, y_max=0.2, label="cell"),
+    ]
+
+
+def test_bbox_collection_from_bboxes(bboxes):
+    actual_collection = BBoxCollection.from_bboxes(bboxes)
+    assert len(actual_collection) == 3
+    assert actual_collection.labels == ("cell", "door")
+    assert actual_collection[1] == bboxes[1]
+    assert list(actual_collection) == bboxes
+
+
+def test_bbox_collection_slicing_and_filtering(bboxes):
+    actual_collection = BBoxCollection.from_bboxes(bboxes)
+
+    actual_slice = actual_collection[1:]
+    assert isinstance(actual_slice, BBoxCollection)
+    assert list(actual_slice) == bboxes[1:]
+
+    actual_cells = actual_collection.filter_label("cell")
+    assert len(actual_cells) == 2
+    assert all(b.label == "cell" for b in actual_cells)
+    assert len(actual_collection.filter_label("window")) == 0
+
+
+def test_bbox_collection_serialization(bboxes):
+    actual_collection = BBoxCollection.from_bboxes(bboxes)
+    assert actual_collection.to_dicts() == [b.to_dict() for b in bboxes]
+
+    actual_lines = actual_collection.to_jsonl().split("\n")
+    assert len(actual_lines) == 3
+    assert json.loads(actual_lines[1])["displayName"] == "door"
+
+
+def test_image_metadata_to_dict_with_bbox_collection():
+    img = ImageMetadata(url="dummy-url", rid="dummyId", title="dummy",
+                        width=100, height=100, columns=10, rows=10)
+    img.bboxes = BBoxCollection(np.array([[0.1, 0.2, 0.3, 0.4]]),
+                                label="cell")
+
+    actual_dict = img.to_dict()
+    assert img.num_bboxes == 1
+    assert actual_dict["bboxes"][0]["yMax"] == 0.4
+    assert actual_dict["bboxes"][0]["displayName"] == "cell"
+
+
+def test_image_metadata_to_dict_does_not_mutate():
+    img = ImageMetadata(url="dummy-url", rid="dummyId", title="dummy",
+                        path="maps/dummy.jpg", width=100, height=100,
+                        columns=10, rows=10)
+    img.bboxes = [BBox(x_min=0.1, x_max=0.2, y_min=0.3, y_max=0.4)]
+
+    actual_dict = img.to_dict()
+    actual_dict.pop("path")
+
+    assert img.to_dict() == {**actual_dict, "path": "maps/dummy.jpg"}
+    assert isinstance(img.bboxes[0], BBox)
+    assert "vtt" not in vars(img)
+    assert json.loads(str(img))["vtt"]["cellWidth"] == 10
+
+
+def test_image_metadata_to_dict_cache_is_cleared_on_set():
+    img = ImageMetadata(url="dummy-url", rid="dummyId", title="dummy")
+    assert img.to_dict()["title"] == "dummy"
+    assert img.to_json_bytes() is img.to_json_bytes()
+
+    img.title = "renamed"
+    assert img.to_dict()["title"] == "renamed"
+    assert json.loads(img.to_json_bytes())["title"] == "renamed"
+
+    img.width = 200
+    assert img.to_dict()["vtt"]["imageWidth"] == 200
@@ -0,0 +1,78 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import subprocess
+import sys
+
+import pytest
+
+# Generous enough for a slow CI machine; importing PIL, imgaug or the Google
+# Cloud clients eagerly blows well past it.
+IMPORT_TIME_BUDGET = 1.0
+
+HEAVY_MODULES = [
+    "PIL",
+    "google.cloud.firestore",
+    "google.cloud.storage",
+    "imageio",
+    "imgaug",
+    "praw",
+    "requests",
+    "spacy",
+]
+
+
+def _import_in_subprocess(module):
+    script = f"""
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "elapsed": elapsed,
+    "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+    output = subprocess.run([sys.executable, "-c", script], check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def test_import_fantasy_maps_image_time_budget():
+    actual_import = _import_in_subprocess("fantasy_maps.image")
+    assert actual_import["elapsed"] < IMPORT_TIME_BUDGET
+    assert actual_import["loaded"] == []
+
+
+@pytest.mark.parametrize("module", [
+    "fantasy_maps.image.extract",
+    "fantasy_maps.image.processed_grid_image",
+    "fantasy_maps.image.shards",
+    "fantasy_maps.gcp.firestore",
+    "fantasy_maps.gcp.storage",
+    "fantasy_maps.reddit.posts",
+])
+def test_import_defers_heavy_dependencies(module):
+    actual_import = _import_in_subprocess(module)
+    assert actual_import["loaded"] == []
+
+
+def test_lazy_submodule_access():
+    import fantasy_maps.gcp
+    import fantasy_maps.image
+
+    assert fantasy_maps.image.extract.compute_bboxes
+    assert fantasy_maps.gcp.storage.store_image_gcs
+    with pytest.raises(AttributeError):
+        fantasy_maps.image.not_a_module
@@ -0,0 +1,121 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import pathlib
+
+import pytest
+from PIL import Image, UnidentifiedImageError
+
+from fantasy_maps.image import large_image
+
+RESOURCE = os.path.join(pathlib.Path(__file__).parent.resolve(),
+                        "../resources/gridded-ruined-keep.jpg")
+
+# The decoded size of the 640 x 640 RGB resource image
+FULL_BYTES = 640 * 640 * 4
+
+
+@pytest.fixture
+def small_bomb_limit(monkeypatch):
+    # Treat the resource image as a decompression bomb
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+
+
+def test_open_large_image(small_bomb_limit):
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(RESOURCE)
+
+    with large_image.open_large_image(RESOURCE) as img:
+        assert img.size == (640, 640)
+
+        # The check still applies everywhere else
+        assert Image.MAX_IMAGE_PIXELS == 1000
+        with pytest.raises(Image.DecompressionBombError):
+            Image.open(RESOURCE)
+
+
+def test_open_large_image_not_an_image(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("not an image")
+
+    with pytest.raises(UnidentifiedImageError):
+        with large_image.open_large_image(str(path)):
+            pass
+
+
+def test_load_bounded_jpeg(small_bomb_limit):
+    with large_image.open_large_image(RESOURCE) as img:
+        actual_img, actual_scale = large_image.load_bounded(
+            img, max_bytes=FULL_BYTES // 3)
+
+        assert actual_img.size == (320, 320)
+        assert actual_scale == (2, 2)
+
+    with large_image.open_large_image(RESOURCE) as img:
+        actual_img, actual_scale = large_image.load_bounded(img,
+                                                      max_bytes=FULL_BYTES)
+
+        assert actual_img.size == (640, 640)
+        assert actual_scale == (1, 1)
+
+    with large_image.open_large_image(RESOURCE) as img:
+        with pytest.raises(ValueError):
+            large_image.load_bounded(img, max_bytes=100)
+
+
+def test_load_bounded_reduce_factor():
+    with large_image.open_large_image(RESOURCE) as img:
+        actual_img, actual_scale = large_image.load_bounded(
+            img, reduce_factor=5)
+
+        # Drafted at 1/4 scale, then resized the rest of the way to at
+        # least 1/5
+        assert max(actual_img.size) <= 640 // 5
+        assert min(actual_scale) >= 5
+        assert actual_img.size == (128, 128)
+
+
+@pytest.mark.parametrize("reduce_factor, expected_size", [
+    (3, (213, 160)),
+    (6, (106, 80)),
+])
+def test_load_bounded_reduce_factor_not_power_of_two(tmp_path, reduce_factor,
+                                                     expected_size):
+    path = str(tmp_path / "keep.jpg")
+    with Image.open(RESOURCE) as img:
+        img.resize((640, 480)).save(path)
+
+    with large_image.open_large_image(path) as img:
+        actual_img, actual_scale = large_image.load_bounded(
+            img, reduce_factor=reduce_factor)
+
+        assert actual_img.size == expected_size
+        assert actual_scale == (640 / expected_size[0],
+                                480 / expected_size[1])
+
+
+def test_load_bounded_png(tmp_path):
+    path = str(tmp_path / "keep.png")
+    with Image.open(RESOURCE) as img:
+        img.save(path)
+
+    with large_image.open_large_image(path) as img:
+        with pytest.raises(ValueError):
+            large_image.load_bounded(img, max_bytes=FULL_BYTES - 1)
+
+    with large_image.open_large_image(path) as img:
+        actual_img, actual_scale = large_image.load_bounded(img,
+                                                      max_bytes=FULL_BYTES)
+        assert actual_img.size == (640, 640)
+        assert actual_scale == (1, 1)
@@ -0,0 +1,128 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+import pytest
+
+from fantasy_maps.gcp.manifest import TrainingManifestWriter
+from fantasy_maps.image.processed_grid_image import ProcessedGridImage
+
+PREFIX = "fantasy-maps-tests"
+
+
+def _row(num):
+    return {"imageGcsUri": f"gs://fake-bucket/{PREFIX}/{num}.jpg",
+            "boundingBoxAnnotations": []}
+
+
+def _read_rows(blob):
+    lines = blob.download_as_bytes().decode("utf-8").splitlines()
+    return [json.loads(line) for line in lines]
+
+
+def test_manifest_writer_flushes_numbered_shards(fake_bucket):
+    with TrainingManifestWriter(fake_bucket, PREFIX,
+                                rows_per_shard=2) as writer:
+        for num in range(5):
+            writer.write(_row(num))
+
+    actual_shards = writer.shard_names()
+    assert actual_shards == [f"{PREFIX}/index-0000{n}.jsonl" for n in range(3)]
+    assert _read_rows(fake_bucket.blob(actual_shards[2])) == [_row(4)]
+
+
+def test_manifest_writer_continues_numbering(fake_bucket):
+    with TrainingManifestWriter(fake_bucket, PREFIX) as writer:
+        writer.write(_row(0))
+
+    with TrainingManifestWriter(fake_bucket, PREFIX) as writer:
+        writer.write(_row(1))
+
+    assert writer.shard_names() == [f"{PREFIX}/index-00000.jsonl",
+                                    f"{PREFIX}/index-00001.jsonl"]
+
+
+def test_manifest_writer_compose(fake_bucket):
+    with TrainingManifestWriter(fake_bucket, PREFIX,
+                                rows_per_shard=1) as writer:
+        for num in range(40):
+            writer.write(_row(num))
+
+    actual_manifest = writer.compose()
+    assert actual_manifest == f"{PREFIX}/index.jsonl"
+    assert _read_rows(fake_bucket.blob(actual_manifest)) == [
+        _row(n) for n in range(40)
+    ]
+
+
+def test_manifest_writer_compose_every(fake_bucket):
+    writer = TrainingManifestWriter(fake_bucket, PREFIX, rows_per_shard=1,
+                                    compose_every=2)
+    for num in range(3):
+        writer.write(_row(num))
+
+    actual_rows = _read_rows(fake_bucket.blob(writer.manifest_name))
+    assert actual_rows == [_row(0), _row(1)]
+
+
+def test_manifest_writer_keeps_rows_until_uploaded(fake_bucket, monkeypatch):
+    writer = TrainingManifestWriter(fake_bucket, PREFIX)
+    writer.write(_row(0))
+
+    def fail_upload(*args, **kwargs):
+        raise ConnectionError("upload failed")
+
+    with monkeypatch.context() as m:
+        m.setattr(type(fake_bucket.blob("any")), "upload_from_string",
+                  fail_upload)
+        with pytest.raises(ConnectionError):
+            writer.flush()
+
+    actual_shard = writer.flush()
+    assert _read_rows(fake_bucket.blob(actual_shard)) == [_row(0)]
+
+
+def test_manifest_writer_skips_flush_on_error(fake_bucket):
+    with pytest.raises(RuntimeError):
+        with TrainingManifestWriter(fake_bucket, PREFIX) as writer:
+            writer.write(_row(0))
+            raise RuntimeError("batch failed")
+
+    assert writer.shard_names() == []
+
+
+def test_manifest_writer_keeps_existing_manifest(fake_storage_client,
+                                                 fake_bucket):
+    # A manifest written by the older, rewrite-the-whole-file path
+    legacy_image = ProcessedGridImage(
+        100, 100, [[0.0, 0.5, 0.0, 0.5]], [0.9],
+        gcs_file_uri=f"gs://fake-bucket/{PREFIX}/legacy.jpg")
+    legacy_image.store_image_as_dataset_row(
+        "fake-bucket", PREFIX, storage_client=fake_storage_client)
+    expected_rows = _read_rows(fake_bucket.blob(f"{PREFIX}/index.jsonl"))
+
+    with TrainingManifestWriter(fake_bucket, PREFIX) as writer:
+        writer.write(_row(0))
+
+    actual_manifest = writer.compose()
+    assert actual_manifest == f"{PREFIX}/index.jsonl"
+    assert _read_rows(fake_bucket.blob(actual_manifest)) == (
+        expected_rows + [_row(0)])
+
+    # The existing rows are only copied once
+    with TrainingManifestWriter(fake_bucket, PREFIX) as writer:
+        writer.write(_row(1))
+
+    assert _read_rows(fake_bucket.blob(writer.compose())) == (
+        expected_rows + [_row(0), _row(1)])
@@ -0,0 +1,95 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+
+from fantasy_maps.image import BBox, ImageMetadata, extract, parquet_io
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+@pytest.fixture
+def images():
+    parent = ImageMetadata(url="url", rid="rid", title="Canal Street",
+                           uid="parent-1", width=560, height=800,
+                           columns=14, rows=20)
+    parent.bboxes = extract.compute_bboxes(img_metadata=parent)
+
+    shard = ImageMetadata(url="url", rid="rid", title="Canal Street",
+                          uid="shard-1", parent_uid="parent-1",
+                          is_shard=True, width=200, height=200,
+                          columns=5, rows=5, shard_scale=2.0)
+    shard.bboxes = [BBox(x_min=0.1, x_max=0.2, y_min=0.1, y_max=0.2,
+                         label="door")]
+
+    other = ImageMetadata(url="url-2", rid="rid-2", title="Old Watermill",
+                          uid="parent-2", width=300, height=450,
+                          columns=30, rows=45, is_usable=False)
+
+    return [shard, parent, other]
+
+
+def test_write_and_read_parquet(images, tmp_path):
+    path = str(tmp_path / "maps.parquet")
+    parquet_io.write_parquet(images, path)
+
+    # One row group per parent image, with its shards
+    assert pq.ParquetFile(path).metadata.num_row_groups == 2
+
+    actual_images = {i.uid: i for i in parquet_io.read_parquet(path)}
+    assert sorted(actual_images) == ["parent-1", "parent-2", "shard-1"]
+
+    actual_parent = actual_images["parent-1"]
+    assert actual_parent.columns == 14
+    assert np.allclose(actual_parent.bboxes.coords, images[1].bboxes.coords)
+    assert actual_parent.bboxes[0].label == "cell"
+
+    actual_shard = actual_images["shard-1"]
+    assert actual_shard.is_shard
+    assert actual_shard.shard_scale == 2.0
+    assert list(actual_shard.bboxes) == images[0].bboxes
+
+    actual_other = actual_images["parent-2"]
+    assert len(actual_other.bboxes) == 0
+    assert not actual_other.is_usable
+
+
+def test_write_and_read_parquet_same_uid(tmp_path):
+    # Images that haven't been downloaded yet don't have a uid
+    images = [ImageMetadata(url=f"url-{n}", rid=f"rid-{n}", title="map",
+                            width=100, height=100, columns=n + 2, rows=2)
+              for n in range(3)]
+    for img in images:
+        img.bboxes = extract.compute_bboxes(img_metadata=img)
+
+    path = str(tmp_path / "maps.parquet")
+    parquet_io.write_parquet(images, path)
+
+    actual_images = parquet_io.read_parquet(path)
+    assert [i.url for i in actual_images] == ["url-0", "url-1", "url-2"]
+    for actual_img, img in zip(actual_images, images):
+        assert len(actual_img.bboxes) == len(img.bboxes)
+
+
+def test_read_parquet_with_filters(images, tmp_path):
+    path = str(tmp_path / "maps.parquet")
+    parquet_io.write_parquet(images, path)
+
+    actual_shards = parquet_io.read_parquet(
+        path, filters=[("is_shard", "=", True)])
+    assert [i.uid for i in actual_shards] == ["shard-1"]
+
+    actual_table = parquet_io.read_parquet_table(
+        path, columns=["uid", "x_min"], filters=[("uid", "=", "parent-1")])
+    assert actual_table.num_rows == 12 * 18
@@ -27,3 +27,17 @@ def test_posts_make_nice_filename(post_name):
 
     assert actual_filename
     assert "/" not in actual_filename
+
+
+def test_posts_make_nice_filenames(post_name):
+    titles = [post_name, "No grid here", "Old Watermill - Battle Map (30x45)"]
+    actual_filenames = posts.make_nice_filenames(titles, batch_size=2)
+
+    assert len(actual_filenames) == 3
+    assert actual_filenames[0] == posts.make_nice_filename(post_name)
+    assert actual_filenames[1] == ""
+    assert actual_filenames[2].endswith(".30x45.jpg")
+
+
+def test_posts_get_nlp_is_cached():
+    assert posts.get_nlp() is posts.get_nlp()
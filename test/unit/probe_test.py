@@ -0,0 +1,77 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import pathlib
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+from fantasy_maps.image import extract
+from fantasy_maps.image.probe import probe_image_size
+
+
+@pytest.fixture
+def img_resource_dir():
+    return os.path.join(pathlib.Path(__file__).parent.resolve(),
+                        "../resources/")
+
+
+@pytest.mark.parametrize("name", ["small_cemetary.17x22.jpg",
+                                  "gridded-ruined-keep.jpg"])
+def test_probe_image_size_jpeg(img_resource_dir, name):
+    path = os.path.join(img_resource_dir, name)
+    with Image.open(path) as img:
+        expected_size = img.size
+
+    assert probe_image_size(path) == expected_size
+
+
+@pytest.mark.parametrize("ext, options", [
+    ("png", {}),
+    ("webp", {}),
+    ("webp", {"lossless": True}),
+])
+def test_probe_image_size_other_formats(tmp_path, ext, options):
+    path = str(tmp_path / f"probe.{ext}")
+    Image.new("RGB", (123, 45)).save(path, **options)
+
+    assert probe_image_size(path) == (123, 45)
+
+
+def test_probe_image_size_unknown_format(tmp_path):
+    path = tmp_path / "probe.txt"
+    path.write_text("not an image")
+
+    assert probe_image_size(str(path)) is None
+
+
+def test_get_image_width_and_height_large(tmp_path):
+    # Only the header of a 100,000 x 100,000 pixel PNG
+    ihdr = struct.pack(">IIBBBBB", 100000, 100000, 8, 2, 0, 0, 0)
+    path = tmp_path / "huge.png"
+    path.write_bytes(b"\x89PNG\r\n\x1a\n" + struct.pack(">I", len(ihdr))
+                     + b"IHDR" + ihdr + struct.pack(">I", zlib.crc32(ihdr)))
+
+    assert probe_image_size(str(path)) == (100000, 100000)
+    assert extract.get_image_width_and_height(str(path)) == (100000, 100000)
+
+
+def test_get_images_width_and_height(img_resource_dir):
+    paths = [os.path.join(img_resource_dir, "small_cemetary.17x22.jpg"),
+             os.path.join(img_resource_dir, "gridded-ruined-keep.jpg")]
+
+    actual_sizes = extract.get_images_width_and_height(paths)
+    assert actual_sizes == [(564, 729), (640, 640)]
@@ -0,0 +1,100 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+import numpy as np
+import pytest
+
+from fantasy_maps.image.processed_grid_image import ProcessedGridImage
+
+WIDTH = 1000
+HEIGHT = 500
+
+
+@pytest.fixture
+def predictions():
+    # A 20 x 10 grid of 50 pixel cells, as fractions of the image size
+    bboxes = []
+    for x in range(0, WIDTH, 50):
+        for y in range(0, HEIGHT, 50):
+            bboxes.append([x / WIDTH, (x + 50) / WIDTH,
+                           y / HEIGHT, (y + 50) / HEIGHT])
+    confidences = [0.9] * len(bboxes)
+    return bboxes, confidences
+
+
+def test_processed_grid_image(predictions):
+    bboxes, confidences = predictions
+    actual_image = ProcessedGridImage(WIDTH, HEIGHT, bboxes, confidences,
+                                      drift_amount=0)
+
+    assert actual_image.prediction_boxes.shape == (200, 4)
+    assert actual_image.bboxes_on_image.shape == (200, 4)
+    assert actual_image.bboxes_on_image[1].tolist() == pytest.approx(
+        [0, 50, 50, 100])
+
+    assert actual_image.cell_width == 50
+    assert actual_image.cell_height == 50
+    assert actual_image.grid_cells_width == 20
+    assert actual_image.grid_cells_height == 10
+    assert actual_image.normalized_bboxes.shape == (200, 4)
+    assert actual_image.normalized_bboxes[:2].tolist() == [
+        [0, 50, 0, 50],
+        [0, 50, 50, 100],
+    ]
+
+    actual_grid_boxes = actual_image._compute_grid_based_boxes()
+    assert np.array_equal(actual_grid_boxes, actual_image.normalized_bboxes)
+
+    actual_json = json.loads(actual_image.get_normalized_json_dnd())
+    assert actual_json["cellWidth"] == 50
+    assert actual_json["imageHeight"] == HEIGHT
+
+
+def test_processed_grid_image_drift(predictions):
+    bboxes, confidences = predictions
+    actual_image = ProcessedGridImage(WIDTH, HEIGHT, bboxes, confidences)
+
+    # Boxes shrink by the drift amount, but stay on the 50 pixel grid
+    assert actual_image.normalized_bboxes[:2].tolist() == [
+        [0, 45, 0, 45],
+        [0, 45, 50, 95],
+    ]
+    assert actual_image.normalized_bboxes[-1].tolist() == [
+        950, 995, 450, 495]
+    assert len(actual_image.normalized_bboxes) == 200
+
+
+def test_processed_grid_image_oversized_predictions():
+    # 56 pixel predicted boxes, centered on a 50 pixel grid
+    bboxes = []
+    for x in range(0, WIDTH, 50):
+        for y in range(0, HEIGHT, 50):
+            bboxes.append([(x - 3) / WIDTH, (x + 53) / WIDTH,
+                           (y - 3) / HEIGHT, (y + 53) / HEIGHT])
+    actual_image = ProcessedGridImage(WIDTH, HEIGHT, bboxes,
+                                      [0.9] * len(bboxes))
+
+    assert actual_image.cell_width == 50
+    assert actual_image.cell_offset_x == 0
+    actual_x_mins = np.unique(actual_image.normalized_bboxes[:, 0])
+    assert actual_x_mins == pytest.approx(np.arange(0, WIDTH, 50))
+
+
+def test_processed_grid_image_mismatched_confidences(predictions):
+    bboxes, confidences = predictions
+
+    with pytest.raises(ValueError):
+        ProcessedGridImage(WIDTH, HEIGHT, bboxes, confidences[:-1])
+
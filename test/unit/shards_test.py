@@ -14,8 +14,10 @@
 import os
 import pathlib
 import pytest
+import shutil
+from PIL import Image
 
-from fantasy_maps.image import shards
+from fantasy_maps.image import extract, shards
 from fantasy_maps.image.image_metadata import ImageMetadata
 
 
@@ -71,6 +73,101 @@ def test_create_shard(img):
     os.remove(actual_shard_url)
 
 
+def test_create_shards(img):
+    coords = [(0, 0, 320, 320, 10, 10), (320, 320, 640, 640, 10, 10)]
+    actual_shards = shards.create_shards(parent_img=img, coords=coords)
+    assert len(actual_shards) == 2
+
+    for actual_shard_metadata in actual_shards:
+        assert actual_shard_metadata
+        assert actual_shard_metadata.is_shard
+        assert actual_shard_metadata.width == 320
+        assert actual_shard_metadata.shard_scale == 1
+        assert os.path.exists(actual_shard_metadata.path)
+        os.remove(actual_shard_metadata.path)
+
+    assert actual_shards[0].uid != actual_shards[1].uid
+
+
+def test_create_shards_reduced(img):
+    actual_shards = shards.create_shards(
+        parent_img=img, coords=[(0, 0, 320, 320, 10, 10)], reduce_factor=2
+    )
+    actual_shard_metadata = actual_shards[0]
+    assert actual_shard_metadata.width == 160
+    assert actual_shard_metadata.height == 160
+    assert actual_shard_metadata.cell_width == 16
+
+    # clean up
+    os.remove(actual_shard_metadata.path)
+
+
+def test_create_shards_memory_bounded(img, monkeypatch, capsys):
+    # Treat the parent image, but not the shard, as a decompression bomb
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 50000)
+    actual_shards = shards.create_shards(
+        parent_img=img, coords=[(0, 0, 320, 320, 10, 10)],
+        max_bytes=320 * 320 * 4,
+    )
+    assert "Downsampled" in capsys.readouterr().out
+
+    actual_shard_metadata = actual_shards[0]
+    assert actual_shard_metadata.width == 160
+    assert actual_shard_metadata.height == 160
+    assert actual_shard_metadata.cell_width == 16
+    assert actual_shard_metadata.cell_height == 16
+    assert actual_shard_metadata.shard_scale == 2
+
+    actual_bboxes = extract.compute_bboxes(img_metadata=actual_shard_metadata)
+    assert len(actual_bboxes) == 8 * 8
+
+    # clean up
+    os.remove(actual_shard_metadata.path)
+
+
+def test_generate_shards(img, tmp_path):
+    parent_imgs = []
+    for name in ["keep_1.20x20.jpg", "keep_2.20x20.jpg"]:
+        path = str(tmp_path / name)
+        shutil.copy(img.path, path)
+        parent_imgs.append(ImageMetadata(
+            title=img.title, rid=img.rid, url=img.url, path=path,
+            width=img.width, height=img.height, columns=20, rows=20,
+            uid=name,
+        ))
+
+    actual_shards = list(shards.generate_shards(
+        images=parent_imgs, num_shards=2, shard_cols=10, shard_rows=10,
+        max_workers=2, memory_budget=1,
+    ))
+    assert len(actual_shards) == 4
+    assert {s.parent_uid for s in actual_shards} == {"keep_1.20x20.jpg",
+                                                     "keep_2.20x20.jpg"}
+
+    for actual_shard_metadata in actual_shards:
+        assert actual_shard_metadata.is_shard
+        assert len(actual_shard_metadata.bboxes) == 8 * 8
+        assert os.path.exists(actual_shard_metadata.path)
+
+
+def test_generate_shards_unreadable_image(img, tmp_path):
+    path = str(tmp_path / "keep.20x20.jpg")
+    shutil.copy(img.path, path)
+    parent_imgs = [
+        ImageMetadata(title=img.title, rid=img.rid, url=img.url,
+                      path=str(tmp_path / "missing.20x20.jpg"), uid="missing"),
+        ImageMetadata(title=img.title, rid=img.rid, url=img.url, path=path,
+                      width=img.width, height=img.height, columns=20,
+                      rows=20, uid="keep"),
+    ]
+
+    actual_shards = list(shards.generate_shards(
+        images=parent_imgs, num_shards=2, shard_cols=10, shard_rows=10,
+        max_workers=1,
+    ))
+    assert [s.parent_uid for s in actual_shards] == ["keep", "keep"]
+
+
 def test_create_shard_path(img):
     actual_str = shards.create_shard_path(
         path=img.path, x_min=0, y_min=0, cols=10, rows=10
@@ -0,0 +1,201 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import pathlib
+import shutil
+
+import pytest
+from google.api_core import exceptions
+
+from fantasy_maps.gcp import storage
+from fantasy_maps.image import ImageMetadata
+
+RESOURCES = ["gridded-ruined-keep.jpg", "small_cemetary.17x22.jpg"]
+
+
+@pytest.fixture
+def images(tmp_path):
+    resource_dir = os.path.join(pathlib.Path(__file__).parent.resolve(),
+                                "../resources/")
+    images = []
+    for name in RESOURCES:
+        path = str(tmp_path / name)
+        shutil.copy(os.path.join(resource_dir, name), path)
+        images.append(ImageMetadata(url="dummy-url", rid="dummyId",
+                                    title=name, uid=f"uid-{name}", path=path))
+    return images
+
+
+def _blob_mtimes(bucket):
+    return {b.name: os.stat(b.path).st_mtime_ns for b in bucket.list_blobs()}
+
+
+def test_store_images_gcs(images, fake_storage_client):
+    actual_uris = storage.store_images_gcs(
+        images, "fake-bucket", "maps", client=fake_storage_client,
+        max_workers=2,
+    )
+
+    assert actual_uris == {
+        f"uid-{name}": f"gs://fake-bucket/maps/{name}" for name in RESOURCES
+    }
+    bucket = fake_storage_client.bucket("fake-bucket")
+    assert sorted(_blob_mtimes(bucket)) == [f"maps/{n}" for n in RESOURCES]
+
+
+def test_store_images_gcs_skips_matching_blobs(images, fake_storage_client):
+    bucket = fake_storage_client.bucket("fake-bucket")
+    storage.store_images_gcs(images, "fake-bucket", "maps",
+                             client=fake_storage_client)
+    expected_mtimes = _blob_mtimes(bucket)
+
+    # Change one of the images, so that only it is uploaded again
+    with open(images[1].path, "ab") as f:
+        f.write(b"changed")
+
+    actual_uris = storage.store_images_gcs(images, "fake-bucket", "maps",
+                                           client=fake_storage_client)
+    actual_mtimes = _blob_mtimes(bucket)
+
+    assert len(actual_uris) == 2
+    assert actual_mtimes[f"maps/{RESOURCES[0]}"] == \
+        expected_mtimes[f"maps/{RESOURCES[0]}"]
+    assert actual_mtimes[f"maps/{RESOURCES[1]}"] != \
+        expected_mtimes[f"maps/{RESOURCES[1]}"]
+
+
+def test_parse_gcs_uri():
+    actual_bucket, actual_blob = storage.parse_gcs_uri(
+        "gs://fake-bucket/fake-prefix/fake-file.jpg")
+
+    assert actual_bucket == "fake-bucket"
+    assert actual_blob == "fake-prefix/fake-file.jpg"
+
+    for uri in ["fake-bucket/fake-file.jpg", "gs://fake-bucket",
+                "gs://fake-bucket/", "gs://fake-bucket/fake-prefix/"]:
+        with pytest.raises(ValueError):
+            storage.parse_gcs_uri(uri)
+
+
+def test_gcs_image_cache_fetch(fake_bucket, fake_storage_client, tmp_path):
+    fake_bucket.blob("maps/a.jpg").upload_from_string(b"a" * 10)
+    cache = storage.GcsImageCache(str(tmp_path / "cache"),
+                                  client=fake_storage_client)
+
+    actual_path = cache.fetch("gs://fake-bucket/maps/a.jpg")
+
+    assert actual_path == str(tmp_path / "cache" / "objects" / "fake-bucket" /
+                              "maps" / "a.jpg")
+    assert "gs://fake-bucket/maps/a.jpg" in cache
+    assert cache.total_bytes == 10
+
+    # A cache hit doesn't go back to the bucket
+    fake_bucket.delete_blob("maps/a.jpg")
+    assert cache.fetch("gs://fake-bucket/maps/a.jpg") == actual_path
+
+    with pytest.raises(exceptions.NotFound):
+        cache.fetch("gs://fake-bucket/maps/missing.jpg")
+    assert len(cache) == 1
+
+
+def test_gcs_image_cache_evicts_least_recently_used(fake_bucket,
+                                                    fake_storage_client,
+                                                    tmp_path):
+    for name in ["a", "b", "c"]:
+        fake_bucket.blob(f"maps/{name}.jpg").upload_from_string(b"x" * 10)
+    cache = storage.GcsImageCache(str(tmp_path / "cache"), max_bytes=25,
+                                  client=fake_storage_client)
+
+    path_a = cache.fetch("gs://fake-bucket/maps/a.jpg")
+    path_b = cache.fetch("gs://fake-bucket/maps/b.jpg")
+    cache.fetch("gs://fake-bucket/maps/a.jpg")
+    cache.fetch("gs://fake-bucket/maps/c.jpg")
+
+    assert "gs://fake-bucket/maps/b.jpg" not in cache
+    assert not os.path.exists(path_b)
+    assert os.path.exists(path_a)
+    assert cache.total_bytes == 20
+
+    # A new cache picks up the files already on disk
+    actual_cache = storage.GcsImageCache(str(tmp_path / "cache"),
+                                         max_bytes=25,
+                                         client=fake_storage_client)
+    assert len(actual_cache) == 2
+    assert actual_cache.total_bytes == 20
+
+
+def test_gcs_image_cache_only_deletes_its_own_files(fake_bucket,
+                                                   fake_storage_client,
+                                                   tmp_path):
+    directory = tmp_path / "tmp"
+    directory.mkdir()
+    (directory / "download.jpg.1234.part").write_bytes(b"x" * 100)
+    (directory / "unrelated.jpg").write_bytes(b"x" * 100)
+    fake_bucket.blob("maps/a.jpg").upload_from_string(b"a" * 10)
+
+    cache = storage.GcsImageCache(str(directory), max_bytes=10,
+                                  client=fake_storage_client)
+    cache.fetch("gs://fake-bucket/maps/a.jpg")
+    cache.clear()
+
+    assert (directory / "download.jpg.1234.part").exists()
+    assert (directory / "unrelated.jpg").exists()
+    assert os.listdir(directory / "incoming") == []
+
+
+@pytest.mark.parametrize("uri", [
+    "gs://fake-bucket/../../outside.jpg",
+    "gs://fake-bucket/maps/../../other-bucket/a.jpg",
+    "gs://fake-bucket/maps/./a.jpg",
+    "gs://fake-bucket/maps//a.jpg",
+    "gs://../maps/a.jpg",
+])
+def test_gcs_image_cache_rejects_paths_outside_cache(fake_bucket,
+                                                     fake_storage_client,
+                                                     tmp_path, uri):
+    fake_bucket.blob("maps/a.jpg").upload_from_string(b"a" * 10)
+    cache = storage.GcsImageCache(str(tmp_path / "cache"),
+                                  client=fake_storage_client)
+
+    with pytest.raises(ValueError):
+        cache.fetch(uri)
+    assert uri not in cache
+    assert not (tmp_path / "outside.jpg").exists()
+
+
+def test_get_image_cache():
+    assert storage.get_image_cache() is storage.get_image_cache()
+
+
+def test_download_gcs_image_to_local(fake_bucket, fake_storage_client,
+                                     tmp_path):
+    from fantasy_maps.image.processed_grid_image import ProcessedGridImage
+
+    fake_bucket.blob("maps/map.jpg").upload_from_string(b"image")
+    cache = storage.GcsImageCache(str(tmp_path / "cache"))
+    actual_image = ProcessedGridImage(
+        1000, 500, [[0.1, 0.2, 0.1, 0.2]], [0.9],
+        gcs_file_uri="gs://fake-bucket/maps/map.jpg",
+    )
+
+    actual_image.download_gcs_image_to_local(
+        storage_client=fake_storage_client, cache=cache)
+
+    with open(actual_image.local_file_uri, "rb") as f:
+        assert f.read() == b"image"
+
+    actual_image.gcs_file_uri = "gs://fake-bucket/maps/missing.jpg"
+    with pytest.raises(NameError):
+        actual_image.download_gcs_image_to_local(
+            storage_client=fake_storage_client, cache=cache)